@@ -0,0 +1,568 @@
+# Generated from exporters/common/pipeline.py by common/sync.py, do not edit.
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, Union
+
+from timeseries import BatchId, TimeseriesDataStore
+
+# Exports the next batch of up to `limit` records after the given sequence number: (data, count, batch_id)
+ExportFn = Callable[[int, Optional[int]], Awaitable[Tuple[Any, int, Optional[BatchId]]]]
+
+# What the ingest queue does with an incoming record while full
+INGEST_FULL_POLICIES = ["block", "drop_newest", "drop_oldest"]
+
+
+class BatchSizeController:
+    """
+    Adapts the export batch size to the measured upload throughput.
+
+    The batch size is set so that an upload takes about `target_latency` seconds at the observed
+    bytes/sec: it grows (at most doubling per upload) while full batches upload faster than the
+    target, and shrinks when uploads take longer. It always stays within the floor and ceiling.
+
+    Attributes:
+        batch_size (int): The current batch size.
+        min_batch_size (int): The batch size floor.
+        max_batch_size (int): The batch size ceiling.
+        target_latency (float): The target upload latency in seconds.
+        latency (Optional[float]): The smoothed upload latency in seconds.
+        throughput (Optional[float]): The smoothed upload throughput in bytes per second.
+        bytes_per_row (Optional[float]): The smoothed exported size of a record in bytes.
+    """
+
+    # Weight of the newest measurement in the smoothed metrics
+    SMOOTHING = 0.3
+
+    def __init__(self, batch_size: int = 1000, min_batch_size: int = 100, max_batch_size: int = 100000, target_latency: float = 5.0):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.batch_size = self._clamp(batch_size)
+
+        self.latency: Optional[float] = None
+        self.throughput: Optional[float] = None
+        self.bytes_per_row: Optional[float] = None
+
+    def configure(self, min_batch_size: int, max_batch_size: int, target_latency: float):
+        """
+        Updates the floor, ceiling and target latency, keeping the batch size within the new limits.
+
+        Args:
+            min_batch_size (int): The batch size floor.
+            max_batch_size (int): The batch size ceiling.
+            target_latency (float): The target upload latency in seconds.
+        """
+        self.min_batch_size = max(1, int(min_batch_size))
+        self.max_batch_size = max(self.min_batch_size, int(max_batch_size))
+        self.target_latency = target_latency
+        self.batch_size = self._clamp(self.batch_size)
+
+    def observe(self, rows: int, size: int, latency: float, full: bool):
+        """
+        Records a finished upload and adjusts the batch size.
+
+        Args:
+            rows (int): The number of records uploaded.
+            size (int): The number of bytes uploaded.
+            latency (float): The upload latency in seconds.
+            full (bool): Whether the batch was full, i.e. there is a backlog to drain.
+        """
+        if rows <= 0 or size <= 0:
+            return
+
+        latency = max(latency, 1e-3)
+        self.latency = self._smooth(self.latency, latency)
+        self.throughput = self._smooth(self.throughput, size / latency)
+        self.bytes_per_row = self._smooth(self.bytes_per_row, size / rows)
+
+        # Number of records that upload in the target latency at the observed throughput
+        target = self.throughput * self.target_latency / self.bytes_per_row
+
+        if self.latency > self.target_latency:
+            batch_size = self._clamp(min(target, self.batch_size))
+        elif full:
+            batch_size = self._clamp(min(target, self.batch_size * 2))
+        else:
+            batch_size = self.batch_size
+
+        if batch_size != self.batch_size:
+            print(
+                f"Adjusted batch size from {self.batch_size} to {batch_size} "
+                f"(latency {self.latency:.2f} s, throughput {self.throughput / 1024:.1f} KiB/s, {self.bytes_per_row:.1f} bytes/record)"
+            )
+            self.batch_size = batch_size
+
+    def _smooth(self, current: Optional[float], value: float) -> float:
+        return value if current is None else current + self.SMOOTHING * (value - current)
+
+    def _clamp(self, batch_size: float) -> int:
+        return int(min(max(batch_size, self.min_batch_size), self.max_batch_size))
+
+
+class UploadPipeline:
+    """
+    Pipelined export/upload loop of a TimeseriesDataStore.
+
+    The next batch is exported while previous batches upload, and up to `concurrency` batches are
+    uploaded in parallel. Batches are still acknowledged in export order, so a failed upload is
+    retried from the acknowledged watermark and no data is lost.
+
+    Uploaded batches are recorded in the batch manifest of the data store before they are
+    acknowledged. On start, the batches a previous run left unacknowledged are resumed from the
+    manifest: uploaded batches are only acknowledged, and the others are exported again with the
+    same range, and so the same name, before being uploaded.
+
+    When 'adaptive_batch_size' is enabled, the batch size is chosen by a BatchSizeController from the
+    measured upload throughput instead of the static 'batch_size'.
+
+    Attributes:
+        data_store (TimeseriesDataStore): The data store to export batches from.
+        export (ExportFn): Exports the next batch after a sequence number.
+        upload (Callable[[Any], Awaitable[None]]): Uploads the data of an exported batch.
+        cleanup (Optional[Callable[[Any], Awaitable[None]]]): Releases the data of a batch once uploaded or discarded.
+        size (Optional[Callable[[Any], int]]): Returns the size in bytes of the data of a batch, used by the batch size controller.
+        controller (BatchSizeController): The adaptive batch size controller.
+        batch_size (Optional[int]): The batch size of the last export.
+        adaptive (bool): Whether 'adaptive_batch_size' is enabled, so the controller observes the uploads.
+    """
+
+    def __init__(
+        self,
+        data_store: TimeseriesDataStore,
+        export: ExportFn,
+        upload: Callable[[Any], Awaitable[None]],
+        cleanup: Optional[Callable[[Any], Awaitable[None]]] = None,
+        size: Optional[Callable[[Any], int]] = None,
+    ):
+        self.data_store = data_store
+        self.export = export
+        self.upload = upload
+        self.cleanup = cleanup
+        self.size = size
+        self.controller = BatchSizeController()
+        self.batch_size: Optional[int] = None
+        self.adaptive = False
+
+        # Exported batches not yet acknowledged, in export order
+        self._in_flight: Deque[Tuple[BatchId, Any, asyncio.Task]] = deque()
+
+    async def run(self, get_config: Callable[[str, Any], Any]):
+        """
+        Runs the export/upload loop until cancelled. On cancellation, the uploads in flight are cancelled and
+        their batches left unacknowledged, so the next run resumes them from the manifest.
+
+        Args:
+            get_config (Callable[[str, Any], Any]): Reads a configuration value ('batch_size', 'upload_interval',
+                'upload_concurrency', 'adaptive_batch_size', 'min_batch_size', 'max_batch_size' and 'target_upload_latency')
+                with a default, so configuration changes apply on the next batch.
+        """
+        try:
+            await self._run(get_config)
+        except asyncio.CancelledError:
+            await self._discard()
+            raise
+
+    async def _run(self, get_config: Callable[[str, Any], Any]):
+        """
+        Runs the export/upload loop forever.
+
+        Args:
+            get_config (Callable[[str, Any], Any]): Reads a configuration value with a default.
+        """
+        try:
+            # Sequence number of the last exported batch, None to export from the acknowledged watermark
+            after = await self._recover(get_config)
+        except Exception as e:
+            print(f"Error occurred during recovery: {e}")
+            await self._discard()
+            after = None
+
+        while True:
+            batch_size = get_config("batch_size", 1000)
+            upload_interval = get_config("upload_interval", 30)
+            concurrency = max(1, int(get_config("upload_concurrency", 1)))
+
+            self.adaptive = bool(get_config("adaptive_batch_size", False))
+            if self.adaptive:
+                if self.controller.latency is None:
+                    # Start from the static batch size until the first upload is measured
+                    self.controller.batch_size = batch_size
+                self.controller.configure(
+                    min_batch_size=get_config("min_batch_size", 100),
+                    max_batch_size=get_config("max_batch_size", 100000),
+                    target_latency=get_config("target_upload_latency", 5),
+                )
+                batch_size = self.controller.batch_size
+            self.batch_size = batch_size
+
+            try:
+                # Export the next batch while previous batches are uploading
+                data, chunk_size, batch_id = await self.export(batch_size, after)
+
+                # The number of records does not tell whether the batch was full, its range may have gaps
+                full = batch_id is not None and self.data_store.has_more(batch_id)
+
+                if batch_id is not None:
+                    after = batch_id[1]
+
+                    # Wait for a free upload slot
+                    while len(self._in_flight) >= concurrency:
+                        await self._ack_completed(wait=True)
+
+                    self._in_flight.append((batch_id, data, asyncio.create_task(self._upload(batch_id, data, chunk_size, full))))
+
+                await self._ack_completed()
+
+                # Skip sleep while records follow the batch
+                if not full:
+                    while self._in_flight:
+                        await self._ack_completed(wait=True)
+
+                    if batch_id is None:
+                        print("No data to upload at this time.")
+                    else:
+                        print("No more data to upload, waiting for next interval.")
+                    await asyncio.sleep(upload_interval)
+                else:
+                    print(f"Chunk was full, continuing to process without sleeping ({len(self._in_flight)} batches in flight).")
+
+            except Exception as e:
+                print(f"Error occurred during upload: {e}")
+
+                # Discard the batches in flight and export again from the acknowledged watermark
+                await self._discard()
+                after = None
+                await asyncio.sleep(upload_interval)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the pipeline metrics: the batch size of the last export, the batches in flight and the state of the
+        batch size controller, which only applies with 'adaptive_batch_size'.
+
+        Returns:
+            Dict[str, Any]: The metric values by name.
+        """
+        return {
+            "batch_size": self.batch_size,
+            "batches_in_flight": len(self._in_flight),
+            "adaptive_batch_size": self.adaptive,
+            "controller": {
+                "batch_size": self.controller.batch_size,
+                "min_batch_size": self.controller.min_batch_size,
+                "max_batch_size": self.controller.max_batch_size,
+                "target_latency": self.controller.target_latency,
+                "latency": self.controller.latency,
+                "throughput": self.controller.throughput,
+                "bytes_per_row": self.controller.bytes_per_row,
+            },
+        }
+
+    async def _recover(self, get_config: Callable[[str, Any], Any]) -> Optional[int]:
+        """
+        Resumes the batches a previous run left unacknowledged in the manifest, without scanning the rest of the backlog.
+
+        Args:
+            get_config (Callable[[str, Any], Any]): Reads a configuration value with a default.
+
+        Returns:
+            Optional[int]: The last sequence number of the resumed batches, None if there were none.
+        """
+        pending = await self.data_store.pending_batches()
+        if not pending:
+            return None
+
+        uploaded = sum(state == "uploaded" for _, state in pending)
+        print(f"Resuming {len(pending)} unacknowledged batches, {uploaded} of them already uploaded.")
+
+        after = None
+        concurrency = max(1, int(get_config("upload_concurrency", 1)))
+
+        for batch_id, state in pending:
+            if state == "uploaded":
+                data, task = None, asyncio.create_task(asyncio.sleep(0))
+            else:
+                data, chunk_size, exported_id = await self.export(batch_id[1] - batch_id[0] + 1, batch_id[0] - 1)
+                if exported_id != batch_id:
+                    # The records of the batch were dropped since, the next batches cover the rest of the backlog
+                    await self._cleanup(data)
+                    continue
+
+                task = asyncio.create_task(self._upload(batch_id, data, chunk_size, False))
+
+            while len(self._in_flight) >= concurrency:
+                await self._ack_completed(wait=True)
+
+            self._in_flight.append((batch_id, data, task))
+            after = batch_id[1]
+
+        while self._in_flight:
+            await self._ack_completed(wait=True)
+
+        return after
+
+    async def _upload(self, batch_id: BatchId, data: Any, rows: int, full: bool):
+        """
+        Uploads the data of a batch, records it as uploaded in the manifest and reports the measured latency
+        and size to the batch size controller when 'adaptive_batch_size' is enabled.
+
+        Args:
+            batch_id (BatchId): The batch id.
+            data (Any): The exported data of the batch.
+            rows (int): The number of records in the batch.
+            full (bool): Whether records follow the batch, i.e. there is a backlog to drain.
+        """
+        start = time.perf_counter()
+        await self.upload(data)
+        latency = time.perf_counter() - start
+
+        await self.data_store.mark_uploaded(batch_id)
+
+        if self.adaptive and self.size is not None:
+            self.controller.observe(rows, self.size(data), latency, full)
+
+    async def _ack_completed(self, wait: bool = False):
+        """
+        Acknowledges the uploaded batches at the head of the in-flight queue, in export order.
+
+        Args:
+            wait (bool): Whether to wait for the oldest batch to finish uploading first.
+
+        Raises:
+            Exception: The error of the oldest batch, if its upload failed.
+        """
+        if wait and self._in_flight:
+            await asyncio.wait([self._in_flight[0][2]])
+
+        while self._in_flight and self._in_flight[0][2].done():
+            batch_id, data, task = self._in_flight[0]
+
+            # We should only acknowledge the batch if upload was successfully
+            task.result()
+            await self.data_store.ack(batch_id)
+
+            self._in_flight.popleft()
+            await self._cleanup(data)
+
+    async def _discard(self):
+        """
+        Cancels the uploads in flight and releases their data without acknowledging them.
+        """
+        while self._in_flight:
+            _, data, task = self._in_flight.popleft()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await self._cleanup(data)
+
+    async def _cleanup(self, data: Any):
+        if self.cleanup is not None and data is not None:
+            try:
+                await self.cleanup(data)
+            except Exception as e:
+                print(f"Error occurred during cleanup: {e}")
+
+
+class IngestQueue:
+    """
+    Bounded queue between the stream consumer and a TimeseriesDataStore, drained by a writer task.
+
+    The consumer only enqueues records, so a slow insert or flush, like a long export holding the
+    database or a checkpoint, does not stall the stream unless the queue is full. While full, the
+    `full_policy` either blocks the consumer until the writer catches up ('block'), discards the
+    incoming record ('drop_newest') or discards the oldest queued record ('drop_oldest').
+
+    The enqueue-to-persist latency of a record runs from its enqueue until the flush writing it to
+    the database completes.
+
+    Attributes:
+        data_store (TimeseriesDataStore): The data store the records are inserted into.
+        max_size (int): The maximum number of queued records.
+        full_policy (str): What to do with an incoming record while the queue is full, one of INGEST_FULL_POLICIES.
+        enqueued (int): The number of records enqueued.
+        persisted (int): The number of records written to the database.
+        dropped (int): The number of records discarded while the queue was full.
+        blocked (int): The number of times the consumer waited for room in the queue.
+        blocked_seconds (float): The total time the consumer waited for room in the queue.
+        errors (int): The number of inserts that failed, whose records stay buffered in the data store for the next flush.
+    """
+
+    def __init__(self, data_store: TimeseriesDataStore, max_size: int = 10000, full_policy: str = "block"):
+        if full_policy not in INGEST_FULL_POLICIES:
+            raise ValueError(f"Unknown ingest full policy '{full_policy}', expected one of {INGEST_FULL_POLICIES}")
+
+        self.data_store = data_store
+        self.max_size = max_size
+        self.full_policy = full_policy
+
+        self.enqueued = 0
+        self.persisted = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.errors = 0
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._writer: Optional[asyncio.Task] = None
+        self._full = False
+
+        # Enqueue times of the records inserted but not yet flushed, by buffer generation: (generation, count, sum, oldest)
+        self._unflushed: Deque[Tuple[int, int, float, float]] = deque()
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._last_latency: Optional[float] = None
+
+    def start(self):
+        """
+        Starts the writer task.
+        """
+        self._writer = asyncio.create_task(self._write())
+
+    async def close(self):
+        """
+        Waits for the writer to insert the queued records, then stops it.
+        """
+        if self._writer is None:
+            return
+
+        if not self._writer.done():
+            join = asyncio.ensure_future(self._queue.join())
+            await asyncio.wait([join, self._writer], return_when=asyncio.FIRST_COMPLETED)
+
+            # The queue never drains if the writer stopped first
+            join.cancel()
+            await asyncio.gather(join, return_exceptions=True)
+
+        self._writer.cancel()
+        await asyncio.gather(self._writer, return_exceptions=True)
+        self._writer = None
+
+    async def put(self, timestamp: datetime, asset: str, datastream: str, payload: Union[float, str, bool]):
+        """
+        Enqueues a record, applying the full policy while the queue is full.
+
+        Args:
+            timestamp (datetime): The timestamp of the data.
+            asset (str): The asset identifier.
+            datastream (str): The datastream identifier.
+            payload (Union[float, str, bool]): The payload data, which can be a number, string, or boolean.
+
+        Raises:
+            Exception: The error the writer task failed with, if it stopped.
+        """
+        # Let the writer drain the queue, as the consumer does not yield while its stream has messages
+        await asyncio.sleep(0)
+
+        if self._writer is not None and self._writer.done():
+            # Surface the failure of the writer instead of filling the queue
+            self._writer.result()
+
+        item = (time.perf_counter(), timestamp, asset, datastream, payload)
+        if not self._queue.full():
+            self._queue.put_nowait(item)
+            self.enqueued += 1
+            if self._queue.qsize() <= self.max_size // 2:
+                # Report the next time the queue fills up
+                self._full = False
+            return
+
+        if not self._full:
+            self._full = True
+            print(f"Ingest queue is full ({self.max_size} records), applying the '{self.full_policy}' policy")
+
+        if self.full_policy == "drop_newest":
+            self.dropped += 1
+            return
+
+        if self.full_policy == "drop_oldest":
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self._queue.put_nowait(item)
+            self.enqueued += 1
+            self.dropped += 1
+            return
+
+        start = time.perf_counter()
+        put = asyncio.ensure_future(self._queue.put(item))
+        if self._writer is not None:
+            await asyncio.wait([put, self._writer], return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                # The writer stopped, so the queue never drains
+                put.cancel()
+                self._writer.result()
+        await put
+        self.enqueued += 1
+        self.blocked += 1
+        self.blocked_seconds += time.perf_counter() - start
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the queue metrics: the depth, the record counters and the enqueue-to-persist latency in seconds.
+
+        Returns:
+            Dict[str, Any]: The metric values by name.
+        """
+        self._observe_flushes()
+        return {
+            "depth": self._queue.qsize(),
+            "max_size": self.max_size,
+            "enqueued": self.enqueued,
+            "persisted": self.persisted,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "blocked_seconds": self.blocked_seconds,
+            "errors": self.errors,
+            "persist_latency_last": self._last_latency,
+            "persist_latency_mean": self._latency_sum / self.persisted if self.persisted else None,
+            "persist_latency_max": self._latency_max,
+        }
+
+    async def _write(self):
+        """
+        Inserts the queued records into the data store, in order.
+        """
+        while True:
+            enqueued_at, timestamp, asset, datastream, payload = await self._queue.get()
+            try:
+                # The record joins the current buffer, before the insert flushes it if full
+                generation = self.data_store.buffer_generation
+                dropped_records = self.data_store.dropped_records
+                try:
+                    await self.data_store.insert(timestamp=timestamp, asset=asset, datastream=datastream, payload=payload)
+                except Exception as e:
+                    # The flush failed with the record buffered, which the next flush writes, so keep draining the queue
+                    self.errors += 1
+                    print(f"Error occurred inserting record into the timeseries database: {e}")
+
+                # Records discarded by the 'stop_ingest' backlog policy are never persisted
+                if self.data_store.dropped_records == dropped_records:
+                    self._track(generation, enqueued_at)
+                self._observe_flushes()
+            finally:
+                self._queue.task_done()
+
+    def _track(self, generation: int, enqueued_at: float):
+        """
+        Records the enqueue time of a record waiting in the data store buffer.
+
+        Args:
+            generation (int): The buffer generation the record was inserted in.
+            enqueued_at (float): The `time.perf_counter()` time the record was enqueued.
+        """
+        if self._unflushed and self._unflushed[-1][0] == generation:
+            _, count, total, oldest = self._unflushed[-1]
+            self._unflushed[-1] = (generation, count + 1, total + enqueued_at, oldest)
+        else:
+            self._unflushed.append((generation, 1, enqueued_at, enqueued_at))
+
+    def _observe_flushes(self):
+        """
+        Accounts the records written by the flushes completed since the last call.
+        """
+        while self._unflushed and self._unflushed[0][0] < self.data_store.flushed_generation:
+            _, count, total, oldest = self._unflushed.popleft()
+            flushed_at = self.data_store.last_flush_time
+            self.persisted += count
+            self._latency_sum += count * flushed_at - total
+            self._latency_max = max(self._latency_max, flushed_at - oldest)
+            self._last_latency = flushed_at - total / count
@@ -0,0 +1,168 @@
+# Generated from exporters/common/query.py by common/sync.py, do not edit.
+import argparse
+import asyncio
+import json
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from timeseries import TimeseriesDataStore
+
+
+class QueryServer:
+    """
+    Read-only HTTP endpoint over the local buffer of a TimeseriesDataStore, for sibling apps and debugging.
+
+    Routes:
+        GET /query?asset=<asset>[&datastream=<datastream>][&start=<iso>][&end=<iso>][&last=<seconds>][&limit=<n>]
+            The records of an asset in a time window, as a JSON list. `last` selects the last seconds up to now.
+        GET /backlog
+            The backlog accounting of the data store, as a JSON object.
+        GET /metrics
+            The metrics of the exporter, as a JSON object.
+
+    Attributes:
+        data_store (TimeseriesDataStore): The data store to query.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        metrics (Optional[Callable[[], Dict[str, Any]]]): Returns the metrics of the exporter.
+    """
+
+    def __init__(self, data_store: TimeseriesDataStore, host: str = "127.0.0.1", port: int = 8080, metrics: Optional[Callable[[], Dict[str, Any]]] = None):
+        self.data_store = data_store
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """
+        Starts listening for queries.
+        """
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"Serving timeseries queries on http://{self.host}:{self.port}")
+
+    async def close(self):
+        """
+        Stops listening for queries.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Answers a single HTTP request and closes the connection.
+
+        Args:
+            reader (asyncio.StreamReader): The request stream.
+            writer (asyncio.StreamWriter): The response stream.
+        """
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                # Skip the headers
+                pass
+
+            if len(request_line) < 2 or request_line[0] != "GET":
+                status, body = "405 Method Not Allowed", {"error": "Only GET requests are supported"}
+            else:
+                status, body = await self._route(urllib.parse.urlsplit(request_line[1]))
+        except Exception as e:
+            status, body = "500 Internal Server Error", {"error": str(e)}
+
+        payload = json.dumps(body, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value)).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _route(self, url: urllib.parse.SplitResult) -> Tuple[str, Any]:
+        """
+        Runs the query of a request path.
+
+        Args:
+            url (urllib.parse.SplitResult): The request URL.
+
+        Returns:
+            Tuple[str, Any]: The HTTP status and the JSON body.
+        """
+        params: Dict[str, str] = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+
+        if url.path == "/backlog":
+            return "200 OK", {
+                "rows": self.data_store.backlog_rows,
+                "bytes": self.data_store.backlog_bytes,
+                "age": self.data_store.backlog_age,
+                "exceeded": self.data_store.backlog_exceeded,
+                "dropped_records": self.data_store.dropped_records,
+            }
+
+        if url.path == "/metrics":
+            return "200 OK", self.metrics() if self.metrics is not None else {}
+
+        if url.path != "/query":
+            return "404 Not Found", {"error": f"Unknown path '{url.path}'"}
+
+        if "asset" not in params:
+            return "400 Bad Request", {"error": "The 'asset' parameter is required"}
+
+        try:
+            start = datetime.fromisoformat(params["start"]) if "start" in params else None
+            end = datetime.fromisoformat(params["end"]) if "end" in params else None
+            if "last" in params:
+                start = datetime.now(timezone.utc) - timedelta(seconds=float(params["last"]))
+            limit = int(params.get("limit", 10000))
+        except ValueError as e:
+            return "400 Bad Request", {"error": str(e)}
+
+        records = await self.data_store.query(asset=params["asset"], datastream=params.get("datastream"), start=start, end=end, limit=limit)
+        return "200 OK", records
+
+
+def main():
+    """
+    Queries the endpoint of a running exporter and prints the records, one JSON object per line.
+    """
+    parser = argparse.ArgumentParser(description="Query the local buffer of a running exporter.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="The query endpoint of the exporter.")
+    parser.add_argument("--asset", help="The asset to query.")
+    parser.add_argument("--datastream", help="The datastream to query. Defaults to all datastreams of the asset.")
+    parser.add_argument("--start", help="The inclusive start of the time window, in ISO format.")
+    parser.add_argument("--end", help="The exclusive end of the time window, in ISO format.")
+    parser.add_argument("--last", type=float, help="Query the last seconds up to now instead of a start time.")
+    parser.add_argument("--limit", type=int, default=10000, help="The maximum number of records, keeping the most recent ones.")
+    parser.add_argument("--backlog", action="store_true", help="Print the backlog accounting instead of records.")
+    parser.add_argument("--metrics", action="store_true", help="Print the exporter metrics instead of records.")
+    args = parser.parse_args()
+
+    if args.backlog:
+        path = "/backlog"
+    elif args.metrics:
+        path = "/metrics"
+    elif args.asset:
+        params = {name: getattr(args, name) for name in ["asset", "datastream", "start", "end", "last", "limit"] if getattr(args, name) is not None}
+        path = f"/query?{urllib.parse.urlencode(params)}"
+    else:
+        parser.error("--asset is required unless --backlog or --metrics is set")
+
+    try:
+        with urllib.request.urlopen(args.url.rstrip("/") + path) as response:
+            body = json.load(response)
+    except urllib.error.HTTPError as e:
+        sys.exit(f"Query failed: {json.load(e).get('error', e.reason)}")
+
+    for record in body if isinstance(body, list) else [body]:
+        print(json.dumps(record))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
 import asyncio
+import base64
 import os
 import posixpath
+import zlib
+from typing import IO, Optional
 
 import aiofiles
 import aiofiles.os
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
+from exporter import FileSink
 
-class AWSS3Uploader:
+MiB = 1024 * 1024
+
+
+class AWSS3Uploader(FileSink):
     def __init__(self):
         # Read AWS credentials from environment variables (or rely on AWS's default credential chain)
         self.aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
@@ -15,13 +25,42 @@ class AWSS3Uploader:
         self.region_name = os.getenv("AWS_REGION", "us-east-1")  # Default region can be changed as needed
         self.bucket_name = os.getenv("AWS_S3_BUCKET")
 
+        self.s3_client = None
+        self.transfer_manager = None
+        self.skip_existing = False
+
+    async def setup(self):
+        """
+        Creates the S3 client and the transfer manager shared by all uploads.
+
+        Files above 's3_multipart_threshold' bytes are uploaded in 's3_multipart_chunksize' byte parts, with up to
+        's3_max_concurrency' parts in flight across all uploads. The connection pool is sized for these parts and
+        for the existence checks of the files uploaded at once.
+        """
+        max_concurrency = max(1, int(self.get_config("s3_max_concurrency", 10)))
+        files_in_flight = max(1, int(self.get_config("upload_concurrency", 1))) * max(1, int(self.get_config("upload_file_concurrency", 1)))
+        transfer_config = TransferConfig(
+            multipart_threshold=int(self.get_config("s3_multipart_threshold", 8 * MiB)),
+            multipart_chunksize=int(self.get_config("s3_multipart_chunksize", 8 * MiB)),
+            max_concurrency=max_concurrency,
+        )
+        self.skip_existing = self.get_config("s3_skip_existing", False)
+
         # Create the boto3 S3 client
         self.s3_client = boto3.client(
             "s3",
             aws_access_key_id=self.aws_access_key_id,
             aws_secret_access_key=self.aws_secret_access_key,
             region_name=self.region_name,
+            config=Config(max_pool_connections=max_concurrency + files_in_flight),
         )
+        self.transfer_manager = create_transfer_manager(self.s3_client, transfer_config)
+
+    async def close(self):
+        """Waits for the transfers in progress and releases the transfer manager threads."""
+        if self.transfer_manager is not None:
+            await asyncio.to_thread(self.transfer_manager.shutdown)
+            self.transfer_manager = None
 
     async def upload(self, file_path: str, dest_dir: str = ""):
         """Asynchronously upload a file to an S3 bucket."""
@@ -39,11 +78,72 @@ class AWSS3Uploader:
 
         print(f"Destination S3 key: '{dest_file_path}'")
 
-        await asyncio.to_thread(self._upload_file, file_path, dest_file_path)
+        if await asyncio.to_thread(self._upload_file, file_path, dest_file_path):
+            print(f"Successfully uploaded file '{file_path}' to '{dest_file_path}' in bucket '{self.bucket_name}'.")
+
+    async def upload_stream(self, data: IO[bytes], file_name: str, dest_dir: str = ""):
+        """Asynchronously upload the contents of a file object to an S3 bucket."""
+
+        dest_file_path = posixpath.join(dest_dir, file_name)
+
+        print(f"Uploading stream to '{dest_file_path}' in bucket '{self.bucket_name}'...")
 
-        print(f"Successfully uploaded file '{file_path}' to '{dest_file_path}' in bucket '{self.bucket_name}'.")
+        if await asyncio.to_thread(self._upload_fileobj, data, dest_file_path):
+            print(f"Successfully uploaded stream to '{dest_file_path}' in bucket '{self.bucket_name}'.")
 
-    def _upload_file(self, file_path: str, dest_file_path: str):
+    def _upload_file(self, file_path: str, dest_file_path: str) -> bool:
         with open(file_path, "rb") as data:
             print(f"Uploading file '{file_path}' to '{dest_file_path}' in bucket '{self.bucket_name}'...")
-            self.s3_client.upload_fileobj(data, self.bucket_name, dest_file_path)
+            return self._upload_fileobj(data, dest_file_path)
+
+    def _upload_fileobj(self, data: IO[bytes], dest_file_path: str) -> bool:
+        """
+        Uploads a file object through the shared transfer manager with a CRC32 checksum, which S3 verifies.
+
+        The SDK computes the checksum while uploading. With `skip_existing`, the checksum of the whole object is computed
+        first and compared with the one S3 stored for the destination key, so an identical object is not uploaded again.
+
+        Returns:
+            bool: Whether the object was uploaded, False if an identical object already exists.
+        """
+        extra_args = {"ChecksumAlgorithm": "CRC32"}
+        if self.skip_existing:
+            checksum = self._crc32(data)
+            if self._remote_crc32(dest_file_path) == checksum:
+                print(f"Skipped upload of '{dest_file_path}', an object with the same CRC32 checksum already exists.")
+                return False
+
+            # Stored as the checksum of the whole object, multipart or not, for the next comparison
+            extra_args = {"ChecksumCRC32": checksum}
+
+        future = self.transfer_manager.upload(data, self.bucket_name, dest_file_path, extra_args=extra_args)
+        future.result()
+        return True
+
+    @staticmethod
+    def _crc32(data: IO[bytes]) -> str:
+        """Returns the CRC32 checksum of a file object in the format of S3, leaving it at its start."""
+        data.seek(0)
+        crc = 0
+        while chunk := data.read(MiB):
+            crc = zlib.crc32(chunk, crc)
+        data.seek(0)
+
+        return base64.b64encode(crc.to_bytes(4, "big")).decode()
+
+    def _remote_crc32(self, dest_file_path: str) -> Optional[str]:
+        """
+        Returns the CRC32 checksum S3 stored for a whole object, or None if the object does not exist or has no whole-object
+        CRC32, like objects uploaded without a checksum or with the composite checksum of their parts.
+        """
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=dest_file_path, ChecksumMode="ENABLED")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+        checksum = response.get("ChecksumCRC32")
+        if checksum is None or "-" in checksum:
+            return None
+        return checksum
@@ -1,18 +1,40 @@
 import os
 import posixpath
+from typing import IO, AsyncIterator, Union
 
 import aiofiles
 import aiofiles.os
 from azure.storage.filedatalake.aio import DataLakeServiceClient
 
+from exporter import FileSink
 
-class AzureDataLakeStorageUploader:
+MiB = 1024 * 1024
+
+
+class AzureDataLakeStorageUploader(FileSink):
 
     def __init__(self):
         self.account_name = os.getenv("AZURE_ACCOUNT_NAME")
         self.account_key = os.getenv("AZURE_ACCOUNT_KEY")
         self.container_name = os.getenv("AZURE_STORAGE_CONTAINER")
-        self.service_client = DataLakeServiceClient(account_url=f"https://{self.account_name}.dfs.core.windows.net", credential=self.account_key)
+        self.account_url = os.getenv("AZURE_ACCOUNT_URL", f"https://{self.account_name}.dfs.core.windows.net")
+        self.service_client = DataLakeServiceClient(account_url=self.account_url, credential=self.account_key)
+
+        # Created once and reused by every upload
+        self.file_system_client = self.service_client.get_file_system_client(file_system=self.container_name)
+
+        self.chunk_size = 8 * MiB
+        self.max_concurrency = 4
+
+    async def setup(self):
+        # Files are streamed in chunks of 'adls_chunk_size' bytes, with up to 'adls_max_concurrency' chunks in flight per file
+        self.chunk_size = int(self.get_config("adls_chunk_size", self.chunk_size))
+        self.max_concurrency = max(1, int(self.get_config("adls_max_concurrency", self.max_concurrency)))
+
+    async def close(self):
+        # Close the connections of the clients
+        await self.file_system_client.close()
+        await self.service_client.close()
 
     async def upload(self, file_path: str, dest_dir: str = ""):
         print(f"uploading file '{file_path}' to adls container: '{self.container_name}'")
@@ -22,21 +44,32 @@ class AzureDataLakeStorageUploader:
             print(f"upload skipped. File '{file_path}' does not exist")
             return
 
-        # Create a client for the file system (container)
-        file_system_client = self.service_client.get_file_system_client(file_system=self.container_name)
-        print(f"got file system client for container: '{self.container_name}'")
-
         # Build the destination file path
         file_name = posixpath.basename(file_path)
         dest_file_path = posixpath.join(dest_dir, file_name)
 
-        # Get a client for the destination file
-        file_client = file_system_client.get_file_client(dest_file_path)
-        print(f"got file client for destination path: '{dest_file_path}'")
+        # Stream the file instead of reading it into memory, without blocking the event loop on disk reads
+        print(f"uploading file '{file_path}' to '{dest_file_path}'")
+        await self._upload_data(self._read_chunks(file_path), dest_file_path, await aiofiles.os.path.getsize(file_path))
+        print(f"successfully uploaded file '{file_path}' to '{dest_file_path}'")
+
+    async def upload_stream(self, data: IO[bytes], file_name: str, dest_dir: str = ""):
+        dest_file_path = posixpath.join(dest_dir, file_name)
+
+        # The length is passed explicitly, so the stream is not probed through its file descriptor
+        length = data.seek(0, os.SEEK_END) - data.seek(0)
+
+        print(f"uploading stream to '{dest_file_path}' in adls container: '{self.container_name}'")
+        await self._upload_data(data, dest_file_path, length)
+        print(f"successfully uploaded stream to '{dest_file_path}'")
+
+    async def _read_chunks(self, file_path: str) -> AsyncIterator[bytes]:
+        # Read the file one chunk at a time through aiofiles
+        async with aiofiles.open(file_path, "rb") as f:
+            while chunk := await f.read(self.chunk_size):
+                yield chunk
 
-        # Open the file to be uploaded asynchronously
-        async with aiofiles.open(file_path, "rb") as data:
-            file_contents = await data.read()
-            print(f"uploading file '{file_path}' to '{dest_file_path}'")
-            await file_client.upload_data(file_contents, overwrite=True)
-            print(f"successfully uploaded file '{file_path}' to '{dest_file_path}'")
+    async def _upload_data(self, data: Union[IO[bytes], AsyncIterator[bytes]], dest_file_path: str, length: int):
+        # The SDK reads the data one chunk at a time, so memory use is bounded by the chunks in flight
+        file_client = self.file_system_client.get_file_client(dest_file_path)
+        await file_client.upload_data(data, length=length, overwrite=True, chunk_size=self.chunk_size, max_concurrency=self.max_concurrency)
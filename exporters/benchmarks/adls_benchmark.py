@@ -0,0 +1,145 @@
+"""
+Measures the upload throughput and peak memory (RSS) of the Azure Data Lake uploader for different
+chunk sizes and concurrency (the `adls_chunk_size` and `adls_max_concurrency` settings). Each setting
+runs in its own process, so its peak RSS is not inflated by the previous ones.
+
+Azurite does not implement the Data Lake (dfs) API, so against Azurite (the default) the files are
+uploaded through its blob endpoint with the same chunking, as ADLS Gen2 stores files as block blobs.
+Pass `--api dfs` with the URL of a storage account with a hierarchical namespace to run the uploader itself.
+
+Usage:
+    azurite-blob --silent &
+    python adls_benchmark.py --file-size 268435456 --chunk-sizes 4194304 8388608 33554432 --concurrency 1 4 8
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "azure-data-lake-uploader"))
+
+# Well-known development account of Azurite
+AZURITE_ACCOUNT_NAME = "devstoreaccount1"
+AZURITE_ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+AZURITE_BLOB_URL = "http://127.0.0.1:10000/devstoreaccount1"
+
+
+async def upload_blob(options: Dict[str, Any], file_path: str, chunk_size: int, max_concurrency: int, iterations: int):
+    from azure.storage.blob.aio import BlobServiceClient
+
+    # The blob client takes the chunking as client settings
+    async with BlobServiceClient(
+        account_url=options["account_url"], credential=options["credential"], max_block_size=chunk_size, max_single_put_size=chunk_size
+    ) as service_client:
+        container_client = service_client.get_container_client(options["container"])
+        if not await container_client.exists():
+            await container_client.create_container()
+
+        latencies = []
+        for i in range(iterations):
+            with open(file_path, "rb") as data:
+                start = time.perf_counter()
+                await container_client.upload_blob(
+                    f"benchmark/{i}.parquet",
+                    data,
+                    length=os.path.getsize(file_path),
+                    overwrite=True,
+                    max_concurrency=max_concurrency,
+                )
+                latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+async def upload_dfs(options: Dict[str, Any], file_path: str, chunk_size: int, max_concurrency: int, iterations: int):
+    os.environ.update(
+        {
+            "AZURE_ACCOUNT_URL": options["account_url"],
+            "AZURE_ACCOUNT_NAME": options["credential"]["account_name"],
+            "AZURE_ACCOUNT_KEY": options["credential"]["account_key"],
+            "AZURE_STORAGE_CONTAINER": options["container"],
+        }
+    )
+    from uploader import AzureDataLakeStorageUploader
+
+    config = {"adls_chunk_size": chunk_size, "adls_max_concurrency": max_concurrency}
+    uploader = AzureDataLakeStorageUploader()
+    uploader.get_config = lambda key, default=None: config.get(key, default)
+    await uploader.setup()
+
+    latencies = []
+    try:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await uploader.upload(file_path, dest_dir="benchmark")
+            latencies.append(time.perf_counter() - start)
+    finally:
+        await uploader.close()
+
+    return latencies
+
+
+def run(options: Dict[str, Any], file_path: str, chunk_size: int, max_concurrency: int, iterations: int, queue: multiprocessing.Queue):
+    upload = upload_dfs if options["api"] == "dfs" else upload_blob
+    latencies = asyncio.run(upload(options, file_path, chunk_size, max_concurrency, iterations))
+
+    # ru_maxrss is in kilobytes on Linux
+    queue.put({"latencies": latencies, "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Azure Data Lake uploader chunking benchmark")
+    parser.add_argument("--api", default="blob", choices=["blob", "dfs"], help="storage API, 'blob' for Azurite")
+    parser.add_argument("--account-url", default=AZURITE_BLOB_URL, help="storage account URL, defaults to Azurite")
+    parser.add_argument("--account-name", default=AZURITE_ACCOUNT_NAME, help="storage account name")
+    parser.add_argument("--account-key", default=AZURITE_ACCOUNT_KEY, help="storage account key")
+    parser.add_argument("--container", default="benchmark", help="container (file system) to upload to")
+    parser.add_argument("--file-size", type=int, default=128 * 1024 * 1024, help="size of the uploaded file in bytes")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[4194304, 8388608, 33554432], help="chunk sizes in bytes to compare")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="chunks in flight to compare")
+    parser.add_argument("--iterations", type=int, default=3, help="uploads per setting")
+    args = parser.parse_args()
+
+    options = {
+        "api": args.api,
+        "account_url": args.account_url,
+        "credential": {"account_name": args.account_name, "account_key": args.account_key},
+        "container": args.container,
+    }
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Random bytes do not compress, like the Parquet files of the exporter
+        file_path = os.path.join(tmp, "upload.parquet")
+        with open(file_path, "wb") as f:
+            for _ in range(0, args.file_size, 1 << 20):
+                f.write(os.urandom(min(1 << 20, args.file_size - f.tell())))
+
+        results: Dict[str, dict] = {}
+        for chunk_size in args.chunk_sizes:
+            for max_concurrency in args.concurrency:
+                queue = context.Queue()
+                process = context.Process(target=run, args=(options, file_path, chunk_size, max_concurrency, args.iterations, queue))
+                process.start()
+                process.join()
+
+                if process.exitcode != 0:
+                    print(f"Benchmark of chunk size {chunk_size} and concurrency {max_concurrency} failed with exit code {process.exitcode}")
+                    continue
+                results[f"{chunk_size // 2**20} MiB/{max_concurrency}"] = queue.get()
+
+    print(f"\n{'chunk size/concurrency':<24} {'p50 (s)':>10} {'MiB/s':>10} {'peak RSS (MiB)':>15}")
+    for name, result in results.items():
+        latency = statistics.median(result["latencies"])
+        print(f"{name:<24} {latency:>10.2f} {args.file_size / 2**20 / latency:>10.1f} {result['peak_rss'] / 2**20:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Measures the per-operation latency of the TimeseriesDataStore against the baseline TimeseriesDataStore
+of a previous revision, which opened a new database connection for every operation, inserted records
+one by one and trimmed exported records with ORDER BY + DELETE.
+
+The baseline is loaded from git, so the benchmark must run from a checkout of the repository, with a
+revision that still has the data store at exporters/aws-s3-uploader/timeseries.py.
+
+Usage:
+    python connection_benchmark.py --rows 1000 --iterations 10 --backlog 1000000 --baseline-revision <revision>
+"""
+
+import argparse
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+import duckdb
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from timeseries import TimeseriesDataStore  # noqa: E402
+
+EXPORTERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Path of the data store at the baseline revision, before it was shared by the exporters
+BASELINE_PATH = "exporters/aws-s3-uploader/timeseries.py"
+
+
+def load_baseline(revision: str) -> types.ModuleType:
+    """
+    Loads the timeseries module of a previous revision from git.
+    """
+    source = subprocess.run(
+        ["git", "show", f"{revision}:{BASELINE_PATH}"], cwd=EXPORTERS_DIR, capture_output=True, text=True, check=True
+    ).stdout
+
+    module = types.ModuleType(f"timeseries_{revision}")
+    exec(compile(source, f"{revision}:{BASELINE_PATH}", "exec"), module.__dict__)
+    return module
+
+
+def generate_rows(start: datetime, count: int):
+    return [(start + timedelta(milliseconds=i), f"asset-{i % 10}", f"datastream-{i % 5}", float(i)) for i in range(count)]
+
+
+def timed(func, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_baseline(store, rows: int, iterations: int, backlog: int):
+    store._setup()
+
+    # Pre-fill the backlog in one statement, since the baseline inserts one record per connection
+    with duckdb.connect(store.db_path) as con:
+        con.execute(
+            f"""
+            INSERT INTO timeseries (timestamp, asset, datastream, payload)
+            SELECT TIMESTAMP '2024-01-01' + to_milliseconds(i), 'asset-' || (i % 10), 'datastream-' || (i % 5), i::DOUBLE
+            FROM range({backlog}) AS r(i)
+            """
+        )
+
+    latencies = {"insert": [], "export": [], "ack": []}
+    start = datetime(2025, 1, 1)
+
+    for i in range(iterations):
+        batch = generate_rows(start + timedelta(hours=i), rows)
+        latencies["insert"].append(timed(lambda: [store._insert(*row) for row in batch]))
+        latencies["export"].append(timed(store._export_data, limit=rows, format="df"))
+        latencies["ack"].append(timed(store._trim, rows))
+
+    return latencies
+
+
+def run(store: TimeseriesDataStore, rows: int, iterations: int, backlog: int):
+    store._setup()
+
+    # Pre-fill the backlog so operations run against a realistic database size
+    start = datetime(2024, 1, 1)
+    for i in range(0, backlog, 100_000):
+        store._insert(generate_rows(start + timedelta(hours=i), min(100_000, backlog - i)))
+
+    latencies = {"insert": [], "export": [], "ack": []}
+    start = datetime(2025, 1, 1)
+
+    for i in range(iterations):
+        batch = generate_rows(start + timedelta(hours=i), rows)
+        latencies["insert"].append(timed(store._insert, batch))
+        export_start = time.perf_counter()
+        _, _, batch_id = store._export_data(limit=rows, format="df")
+        latencies["export"].append((time.perf_counter() - export_start) * 1000)
+        latencies["ack"].append(timed(store._ack, batch_id))
+
+    store._close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TimeseriesDataStore connection benchmark")
+    parser.add_argument("--rows", type=int, default=1000, help="records per operation")
+    parser.add_argument("--iterations", type=int, default=50, help="number of insert/export/ack cycles")
+    parser.add_argument("--backlog", type=int, default=100_000, help="records already in the database")
+    parser.add_argument("--baseline-revision", required=True, help="git revision of the baseline data store")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline_revision)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results[f"baseline ({args.baseline_revision})"] = run_baseline(baseline.TimeseriesDataStore(os.path.join(tmp, "data.db")), args.rows, args.iterations, args.backlog)
+    with tempfile.TemporaryDirectory() as tmp:
+        results["current"] = run(TimeseriesDataStore(os.path.join(tmp, "data.db")), args.rows, args.iterations, args.backlog)
+
+    # The baseline acknowledges a batch by trimming it, and inserts its records one by one
+    width = max(len(name) for name in results)
+    print(f"\n{'operation':<10} {'data store':<{width}} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+    for operation in ["insert", "export", "ack"]:
+        for name, latencies in results.items():
+            values = sorted(latencies[operation])
+            p50 = statistics.median(values)
+            # Nearest-rank percentile
+            p95 = values[math.ceil(len(values) * 0.95) - 1]
+            print(f"{operation:<10} {name:<{width}} {p50:>10.2f} {p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
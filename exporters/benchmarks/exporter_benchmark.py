@@ -0,0 +1,437 @@
+"""
+Runs the `main()` loop of the exporters on synthetic asset data messages, with local stand-ins for
+S3, ADLS and Databricks (see standins.py), and reports the ingest rate, end-to-end latency, export
+latency, upload throughput and peak memory (RSS) of each exporter.
+
+Each exporter runs in its own process and working directory. The results are saved as JSON, and
+compared against a previous results file with --baseline to spot regressions between versions.
+
+Usage:
+    python exporter_benchmark.py --exporters aws-s3-uploader databricks-delta-table-uploader \\
+        --assets 10 --datastreams 20 --rate 5000 --duration 60 --payload-types number string boolean \\
+        --config upload_interval=1 batch_size=10000 --output results.json --baseline previous.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import yaml
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPORTERS_DIR = os.path.dirname(BENCHMARKS_DIR)
+EXPORTERS = ["aws-s3-uploader", "azure-data-lake-uploader", "databricks-volume-uploader", "databricks-delta-table-uploader"]
+
+# Environment of the exporters, pointing them at the stand-ins
+ENVIRONMENT = {
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_REGION": "us-east-1",
+    "AWS_S3_BUCKET": "benchmark",
+    "AZURE_ACCOUNT_NAME": "benchmark",
+    "AZURE_ACCOUNT_KEY": "benchmark",
+    "AZURE_STORAGE_CONTAINER": "benchmark",
+    "DATABRICKS_SERVER_HOSTNAME": "benchmark.cloud.databricks.com",
+    "DATABRICKS_HTTP_PATH": "/sql/1.0/warehouses/benchmark",
+    "DATABRICKS_ACCESS_TOKEN": "benchmark",
+    "DATABRICKS_UC_VOLUME": "benchmark.kelvin.volume",
+    "DATABRICKS_DELTA_TABLE": "benchmark.kelvin.timeseries",
+    "DATABRICKS_DELTA_ROLLUP_TABLE": "benchmark.kelvin.rollups",
+}
+
+DELTA_TABLE_COLUMNS = (
+    "timestamp TIMESTAMP, asset VARCHAR, datastream VARCHAR, payload DOUBLE, payload_type VARCHAR, payload_string VARCHAR, payload_boolean BOOLEAN"
+)
+DELTA_ROLLUP_COLUMNS = (
+    "timestamp TIMESTAMP, asset VARCHAR, datastream VARCHAR, payload_min DOUBLE, payload_max DOUBLE, "
+    "payload_mean DOUBLE, payload_last DOUBLE, payload_count BIGINT"
+)
+
+
+@dataclass
+class Resource:
+    asset: str
+    data_stream: str
+
+
+@dataclass
+class Message:
+    timestamp: datetime
+    resource: Resource
+    payload: Union[float, str, bool]
+
+
+class Metrics:
+    """
+    Measurements collected while an exporter runs.
+    """
+
+    def __init__(self):
+        # Creation time of the messages not acknowledged yet, by the (timestamp, asset, datastream) key of their record.
+        # Sequence numbers are not message numbers, as failed inserts, updates and dropped messages leave gaps.
+        self.created: Dict[Tuple[datetime, str, str], float] = {}
+        self.messages = 0
+        self.ingest_queue = None
+        self.data_store = None
+        self.ingest_start = 0.0
+        self.ingest_end = 0.0
+        self.acked = 0
+        self.end_to_end: List[float] = []
+        self.export_latencies: List[float] = []
+        self.upload_latencies: List[float] = []
+        self.upload_bytes = 0
+        self.upload_rows = 0
+
+    def dropped(self) -> int:
+        """
+        Returns the number of messages discarded by the ingest queue full policy or the 'stop_ingest' backlog policy.
+        """
+        return (self.ingest_queue.dropped if self.ingest_queue else 0) + (self.data_store.dropped_records if self.data_store else 0)
+
+
+METRICS = Metrics()
+
+
+class SyntheticApp:
+    """
+    Stand-in for `KelvinApp` streaming synthetic asset data messages at a fixed rate, then waiting
+    until every message is acknowledged by the exporter before ending the stream.
+    """
+
+    options: Dict[str, Any] = {}
+
+    def __init__(self):
+        self.app_configuration = self.options["config"]
+
+    async def connect(self):
+        pass
+
+    async def stream_filter(self, _filter):
+        assets = [f"asset-{i}" for i in range(self.options["assets"])]
+        datastreams = [f"datastream-{i}" for i in range(self.options["datastreams"])]
+        payload_types = self.options["payload_types"]
+        rate = self.options["rate"]
+        total = int(rate * self.options["duration"])
+
+        # Payload type of each datastream, cycling through the requested types
+        types = {datastream: payload_types[i % len(payload_types)] for i, datastream in enumerate(datastreams)}
+
+        METRICS.ingest_start = time.perf_counter()
+        timestamp = datetime.now(timezone.utc)
+
+        for i in range(total):
+            # Pace the stream to the target rate
+            delay = METRICS.ingest_start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            asset = assets[i % len(assets)]
+            datastream = datastreams[(i // len(assets)) % len(datastreams)]
+            timestamp = max(timestamp + timedelta(microseconds=1), datetime.now(timezone.utc))
+            payload = {"number": float(i), "string": f"value-{i}", "boolean": i % 2 == 0}[types[datastream]]
+
+            # Records are stored with naive UTC timestamps
+            METRICS.created[(timestamp.replace(tzinfo=None), asset, datastream)] = time.perf_counter()
+            METRICS.messages += 1
+            yield Message(timestamp=timestamp, resource=Resource(asset=asset, data_stream=datastream), payload=payload)
+
+        METRICS.ingest_end = time.perf_counter()
+
+        # Let the exporter drain its backlog before the stream ends, not waiting for the dropped messages
+        deadline = time.perf_counter() + self.options["drain_timeout"]
+        while len(METRICS.created) > METRICS.dropped() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+
+
+def instrument(timeseries, pipeline):
+    """
+    Wraps the data store and upload pipeline of an exporter to measure export, upload and end-to-end latencies.
+    """
+    store = timeseries.TimeseriesDataStore
+    upload_pipeline = pipeline.UploadPipeline
+    ingest_queue = pipeline.IngestQueue
+
+    store_init = store.__init__
+
+    def _store_init(self, *args, **kwargs):
+        store_init(self, *args, **kwargs)
+        METRICS.data_store = self
+
+    queue_init = ingest_queue.__init__
+
+    def _queue_init(self, *args, **kwargs):
+        queue_init(self, *args, **kwargs)
+        METRICS.ingest_queue = self
+
+    export_data = store._export_data
+
+    def _export_data(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = export_data(self, *args, **kwargs)
+        METRICS.export_latencies.append(time.perf_counter() - start)
+        return result
+
+    ack = store.ack
+
+    def batch_keys(self, batch_id) -> List[Tuple[datetime, str, str]]:
+        # Read before the acknowledgement, which may drop the segment of the batch
+        with self._segments_lock:
+            segments = list(self._segments)
+        return self._cursor().execute(
+            " UNION ALL ".join(f"SELECT timestamp, asset, datastream FROM {segment.table} WHERE seq BETWEEN ? AND ?" for segment in segments),
+            [seq for _ in segments for seq in batch_id],
+        ).fetchall()
+
+    async def _ack(self, batch_id):
+        keys = await asyncio.to_thread(batch_keys, self, batch_id)
+        await ack(self, batch_id)
+
+        now = time.perf_counter()
+        created = [METRICS.created.pop(key) for key in keys if key in METRICS.created]
+        METRICS.end_to_end.extend(now - value for value in created)
+        METRICS.acked += len(created)
+
+    upload = upload_pipeline._upload
+
+    async def _upload(self, batch_id, data, rows, full):
+        start = time.perf_counter()
+        await upload(self, batch_id, data, rows, full)
+        METRICS.upload_latencies.append(time.perf_counter() - start)
+        METRICS.upload_rows += rows
+        if self.size is not None:
+            METRICS.upload_bytes += self.size(data)
+
+    store.__init__ = _store_init
+    ingest_queue.__init__ = _queue_init
+    store._export_data = _export_data
+    store.ack = _ack
+    upload_pipeline._upload = _upload
+
+
+def install_standins(exporter: str, uploader, s3_endpoint: Optional[str]):
+    """
+    Points the uploader of an exporter at its local stand-in.
+    """
+    import standins
+
+    if exporter == "aws-s3-uploader":
+        import boto3
+
+        # Either a real S3 compatible endpoint, or moto intercepting the boto3 calls in process
+        if s3_endpoint:
+            os.environ["AWS_ENDPOINT_URL"] = s3_endpoint
+        else:
+            from moto import mock_aws
+
+            mock_aws().start()
+
+        s3 = boto3.client("s3", region_name=os.environ["AWS_REGION"])
+        if os.environ["AWS_S3_BUCKET"] not in [bucket["Name"] for bucket in s3.list_buckets()["Buckets"]]:
+            s3.create_bucket(Bucket=os.environ["AWS_S3_BUCKET"])
+    elif exporter == "azure-data-lake-uploader":
+        uploader.DataLakeServiceClient = standins.LocalDataLakeServiceClient
+    elif exporter == "databricks-volume-uploader":
+        uploader.WorkspaceClient = standins.LocalWorkspaceClient
+    elif exporter == "databricks-delta-table-uploader":
+        standins.LocalSqlWarehouse.create_table(os.environ["DATABRICKS_DELTA_TABLE"], DELTA_TABLE_COLUMNS)
+        standins.LocalSqlWarehouse.create_table(os.environ["DATABRICKS_DELTA_ROLLUP_TABLE"], DELTA_ROLLUP_COLUMNS)
+        uploader.sql = standins.LocalSqlWarehouse
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+
+    # Nearest-rank p95
+    values = sorted(values)
+    return {"p50": statistics.median(values), "p95": values[math.ceil(len(values) * 0.95) - 1], "max": values[-1]}
+
+
+def run_exporter(exporter: str, options: Dict[str, Any], queue: multiprocessing.Queue):
+    """
+    Runs the `main()` loop of an exporter in the current process and puts its results in the queue.
+    """
+    app_dir = os.path.join(EXPORTERS_DIR, exporter)
+    sys.path[:0] = [app_dir, BENCHMARKS_DIR]
+    os.environ.update(ENVIRONMENT)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # The exporters keep their database and export files relative to the working directory
+        os.chdir(workdir)
+
+        import exporter as core
+        import pipeline
+        import timeseries
+        import uploader
+
+        instrument(timeseries, pipeline)
+        install_standins(exporter, uploader, options["s3_endpoint"])
+
+        import main
+
+        SyntheticApp.options = options
+        core.KelvinApp = SyntheticApp
+
+        asyncio.run(main.main())
+
+        import standins
+
+        ingest_time = METRICS.ingest_end - METRICS.ingest_start
+        upload_time = sum(METRICS.upload_latencies)
+        queue.put(
+            {
+                "exporter": exporter,
+                "messages": METRICS.messages,
+                "acknowledged": METRICS.acked,
+                "dropped": METRICS.dropped(),
+                "ingest_rate": METRICS.messages / ingest_time if ingest_time else None,
+                "end_to_end_latency": percentiles(METRICS.end_to_end),
+                "export_latency": percentiles(METRICS.export_latencies),
+                "upload_latency": percentiles(METRICS.upload_latencies),
+                "upload_records_per_second": METRICS.upload_rows / upload_time if upload_time else None,
+                "upload_bytes_per_second": METRICS.upload_bytes / upload_time if upload_time and METRICS.upload_bytes else None,
+                "uploaded_objects": standins.SINK.objects,
+                "uploaded_bytes": standins.SINK.bytes,
+                # ru_maxrss is in kilobytes on Linux
+                "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            }
+        )
+
+
+def parse_config(values: List[str]) -> Dict[str, Any]:
+    config = {}
+    for value in values:
+        key, _, raw = value.partition("=")
+        try:
+            config[key] = json.loads(raw)
+        except json.JSONDecodeError:
+            config[key] = raw
+    return config
+
+
+def app_defaults(exporter: str) -> Dict[str, Any]:
+    with open(os.path.join(EXPORTERS_DIR, exporter, "app.yaml")) as f:
+        return (yaml.safe_load(f).get("defaults") or {}).get("configuration") or {}
+
+
+def revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=EXPORTERS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]]):
+    def fmt(value: Optional[float], scale: float = 1) -> str:
+        return "-" if value is None else f"{value * scale:.1f}"
+
+    def change(result: Dict[str, Any], path: List[str]) -> str:
+        if not baseline or result["exporter"] not in baseline:
+            return ""
+
+        current, previous = result, baseline[result["exporter"]]
+        for key in path:
+            current, previous = (current or {}).get(key), (previous or {}).get(key)
+        if not current or not previous:
+            return ""
+        return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+    rows = [
+        ("ingest rate (msg/s)", ["ingest_rate"], 1),
+        ("end-to-end p50 (ms)", ["end_to_end_latency", "p50"], 1000),
+        ("end-to-end p95 (ms)", ["end_to_end_latency", "p95"], 1000),
+        ("export p50 (ms)", ["export_latency", "p50"], 1000),
+        ("export p95 (ms)", ["export_latency", "p95"], 1000),
+        ("upload (records/s)", ["upload_records_per_second"], 1),
+        ("upload (KiB/s)", ["upload_bytes_per_second"], 1 / 1024),
+        ("peak RSS (MiB)", ["peak_rss"], 1 / 2**20),
+    ]
+
+    for result in results:
+        print(f"\n{result['exporter']}: {result['acknowledged']}/{result['messages']} messages uploaded, {result.get('dropped', 0)} dropped")
+        for name, path, scale in rows:
+            value = result
+            for key in path:
+                value = (value or {}).get(key)
+            print(f"  {name:<22} {fmt(value, scale):>12}{change(result, path)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporter data path benchmark")
+    parser.add_argument("--exporters", nargs="+", default=EXPORTERS, choices=EXPORTERS, help="exporters to benchmark")
+    parser.add_argument("--assets", type=int, default=10, help="number of assets")
+    parser.add_argument("--datastreams", type=int, default=10, help="number of datastreams per asset")
+    parser.add_argument("--rate", type=float, default=1000, help="messages per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of synthetic messages")
+    parser.add_argument("--payload-types", nargs="+", default=["number"], choices=["number", "string", "boolean"], help="payload types of the datastreams")
+    parser.add_argument("--config", nargs="*", default=["upload_interval=1"], help="exporter configuration overrides, as key=value")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="seconds to wait for the backlog to be uploaded")
+    parser.add_argument("--s3-endpoint", help="S3 compatible endpoint (e.g. MinIO) to use instead of moto")
+    parser.add_argument("--output", default="exporter-benchmark.json", help="file to save the results to")
+    parser.add_argument("--baseline", help="results file of a previous run to compare against")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    for exporter in args.exporters:
+        options = {
+            "config": {**app_defaults(exporter), **parse_config(args.config)},
+            "assets": args.assets,
+            "datastreams": args.datastreams,
+            "rate": args.rate,
+            "duration": args.duration,
+            "payload_types": args.payload_types,
+            "drain_timeout": args.drain_timeout,
+            "s3_endpoint": args.s3_endpoint,
+        }
+
+        print(f"Benchmarking {exporter}")
+        queue = context.Queue()
+        process = context.Process(target=run_exporter, args=(exporter, options, queue))
+        process.start()
+        process.join()
+
+        if process.exitcode != 0:
+            print(f"Benchmark of {exporter} failed with exit code {process.exitcode}")
+            continue
+
+        results.append({**queue.get(), "options": options})
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {result["exporter"]: result for result in json.load(f)["results"]}
+
+    print_results(results, baseline)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "revision": revision(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nSaved results to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
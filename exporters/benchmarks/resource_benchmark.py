@@ -0,0 +1,108 @@
+"""
+Measures the export latency and peak memory (RSS) of the TimeseriesDataStore on a large backlog
+for different DuckDB thread and memory limits. Each setting runs in its own process, so its
+peak RSS is not inflated by the previous ones.
+
+Usage:
+    python resource_benchmark.py --backlog 5000000 --threads 1 2 4 --memory-limits 0 268435456 1073741824
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from timeseries import TimeseriesDataStore  # noqa: E402
+
+
+def create_backlog(db_path: str, backlog: int):
+    """
+    Fills a single segment with the backlog, generated by DuckDB rather than inserted from Python.
+    """
+    store = TimeseriesDataStore(db_path, segment_size=backlog + 1)
+    store._setup()
+
+    con = store._cursor()
+    con.execute(
+        f"""
+        INSERT INTO {store._segments[-1].table} (timestamp, asset, datastream, payload)
+        SELECT TIMESTAMP '2024-01-01' + to_milliseconds(i), 'asset-' || (i % 10), 'datastream-' || (i % 5), i::DOUBLE
+        FROM range({backlog}) AS r(i)
+        """
+    )
+    store._close()
+
+
+def run(db_path: str, threads: Optional[int], memory_limit: Optional[int], limit: int, format: str, iterations: int, queue: multiprocessing.Queue):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TimeseriesDataStore(db_path, db_threads=threads, db_memory_limit=memory_limit, db_temp_directory=os.path.join(tmp, "spill"))
+        store._setup()
+
+        # Peak RSS of opening the database, which loads the primary key index of the segments
+        open_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            if format == "parquet":
+                store._export_data(file_path=os.path.join(tmp, "export.parquet"), limit=limit, format="parquet")
+            else:
+                data, _, _ = store._export_data(limit=limit, format=format)
+                if format == "parquet_buffer":
+                    data.close()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        store._close()
+
+    # ru_maxrss is in kilobytes on Linux
+    queue.put({"latencies": latencies, "open_rss": open_rss, "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TimeseriesDataStore DuckDB resource benchmark")
+    parser.add_argument("--backlog", type=int, default=5_000_000, help="records in the database")
+    parser.add_argument("--limit", type=int, default=None, help="records per export, defaults to the whole backlog")
+    parser.add_argument("--format", default="parquet", choices=["parquet", "parquet_buffer", "arrow", "df"], help="export format")
+    parser.add_argument("--iterations", type=int, default=3, help="exports per setting")
+    parser.add_argument("--threads", type=int, nargs="+", default=[0, 1, 2], help="DuckDB threads to compare, 0 for the default")
+    parser.add_argument("--memory-limits", type=int, nargs="+", default=[0, 268435456], help="DuckDB memory limits in bytes to compare, 0 for the default")
+    args = parser.parse_args()
+
+    # The peak RSS is inherited from the parent process, so the backlog is created in a process of its own
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "data.db")
+        print(f"Creating a backlog of {args.backlog} records")
+        process = context.Process(target=create_backlog, args=(db_path, args.backlog))
+        process.start()
+        process.join()
+
+        results: Dict[str, dict] = {}
+        for threads in args.threads:
+            for memory_limit in args.memory_limits:
+                queue = context.Queue()
+                process = context.Process(
+                    target=run, args=(db_path, threads or None, memory_limit or None, args.limit or args.backlog, args.format, args.iterations, queue)
+                )
+                process.start()
+                results[f"{threads or 'default'}/{memory_limit or 'default'}"] = queue.get()
+                process.join()
+
+    print(f"\n{'threads/memory limit':<24} {'p50 (ms)':>10} {'max (ms)':>10} {'open RSS (MiB)':>15} {'peak RSS (MiB)':>15}")
+    for name, result in results.items():
+        print(
+            f"{name:<24} {statistics.median(result['latencies']):>10.1f} {max(result['latencies']):>10.1f} "
+            f"{result['open_rss'] / 2**20:>15.1f} {result['peak_rss'] / 2**20:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
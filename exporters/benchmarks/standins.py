@@ -0,0 +1,192 @@
+"""
+Local stand-ins for the cloud services of the exporters, used by the exporter benchmark.
+
+S3 is served by moto (or any S3 compatible endpoint such as MinIO), while ADLS, Databricks volumes
+and the Databricks SQL warehouse are replaced at the SDK client boundary: Azurite does not implement
+the Data Lake (dfs) API, and Databricks has no local emulator. The stand-ins write to a local
+directory or an in-memory DuckDB database and count the objects, bytes and records they receive.
+"""
+
+import io
+import os
+import threading
+from typing import IO, Any, AsyncIterable, Dict, Optional, Union
+
+import duckdb
+
+
+class Sink:
+    """
+    Counts what a stand-in received.
+
+    Attributes:
+        objects (int): The number of objects (files or INSERT statements) received.
+        bytes (int): The number of bytes received.
+    """
+
+    def __init__(self):
+        self.objects = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, size: int):
+        with self._lock:
+            self.objects += 1
+            self.bytes += size
+
+
+SINK = Sink()
+
+
+def write_file(root: str, path: str, data: IO[bytes]) -> int:
+    """
+    Copies a file object to a path under a root directory.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    dest = os.path.join(root, path.lstrip("/"))
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+    size = 0
+    with open(dest, "wb") as f:
+        while chunk := data.read(1 << 20):
+            size += f.write(chunk)
+
+    SINK.add(size)
+    return size
+
+
+class LocalDataLakeServiceClient:
+    """
+    Stand-in for `azure.storage.filedatalake.aio.DataLakeServiceClient`, writing files under `root/<file system>`.
+    """
+
+    root = "adls"
+
+    def __init__(self, account_url: str = "", credential: Any = None, **kwargs):
+        pass
+
+    def get_file_system_client(self, file_system: str) -> "LocalFileSystemClient":
+        return LocalFileSystemClient(os.path.join(self.root, file_system))
+
+    async def close(self):
+        pass
+
+
+class LocalFileSystemClient:
+    def __init__(self, root: str):
+        self.root = root
+
+    def get_file_client(self, file_path: str) -> "LocalFileClient":
+        return LocalFileClient(self.root, file_path)
+
+    async def close(self):
+        pass
+
+
+class LocalFileClient:
+    def __init__(self, root: str, file_path: str):
+        self.root = root
+        self.file_path = file_path
+
+    async def upload_data(self, data: Union[IO[bytes], AsyncIterable[bytes]], length: Optional[int] = None, overwrite: bool = False, **kwargs):
+        if isinstance(data, AsyncIterable):
+            data = io.BytesIO(b"".join([chunk async for chunk in data]))
+        write_file(self.root, self.file_path, data)
+
+
+class LocalWorkspaceClient:
+    """
+    Stand-in for `databricks.sdk.WorkspaceClient`, writing volume files under `root`.
+    """
+
+    root = "volumes"
+
+    def __init__(self, config: Any = None, **kwargs):
+        self.config = self
+        self.dbfs = self
+        self.files = self
+
+    def authenticate(self) -> Dict[str, str]:
+        return {}
+
+    def upload(self, path: str = None, src: IO[bytes] = None, overwrite: bool = False, file_path: str = None, contents: IO[bytes] = None, **kwargs):
+        # Handles both `dbfs.upload(path, src)` and `files.upload(file_path, contents)`
+        write_file(self.root, path or file_path, src if src is not None else contents)
+
+    def upload_from(self, file_path: str, source_path: str, overwrite: bool = False, **kwargs):
+        with open(source_path, "rb") as data:
+            write_file(self.root, file_path, data)
+
+
+class LocalSqlWarehouse:
+    """
+    Stand-in for the `databricks.sql` module, running the statements on a shared in-memory DuckDB
+    database where the Delta tables are created as `<catalog>.<schema>.<table>`.
+    """
+
+    _database: Optional[duckdb.DuckDBPyConnection] = None
+
+    @classmethod
+    def create_table(cls, name: str, columns: str):
+        if cls._database is None:
+            cls._database = duckdb.connect()
+
+        catalog, schema, _ = name.split(".")
+        if not cls._database.execute("SELECT count(*) FROM duckdb_databases() WHERE database_name = ?", (catalog,)).fetchall()[0][0]:
+            cls._database.execute(f"ATTACH ':memory:' AS {catalog}")
+        cls._database.execute(f"CREATE SCHEMA IF NOT EXISTS {catalog}.{schema}")
+        cls._database.execute(f"CREATE TABLE IF NOT EXISTS {name} ({columns})")
+
+    @classmethod
+    def connect(cls, **kwargs) -> "LocalSqlConnection":
+        return LocalSqlConnection(cls._database.cursor())
+
+    @classmethod
+    def count(cls, name: str) -> int:
+        return cls._database.execute(f"SELECT count(*) FROM {name}").fetchall()[0][0]
+
+
+class LocalSqlConnection:
+    def __init__(self, con: duckdb.DuckDBPyConnection):
+        self.con = con
+
+    def cursor(self) -> "LocalSqlCursor":
+        return LocalSqlCursor(self.con.cursor())
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalSqlCursor:
+    def __init__(self, con: duckdb.DuckDBPyConnection):
+        self.con = con
+
+    def execute(self, operation: str, parameters: Optional[Dict[str, Any]] = None):
+        SINK.add(len(operation))
+        self.con.execute(operation, parameters)
+        return self
+
+    def executemany(self, operation: str, seq_of_parameters: Any):
+        SINK.add(len(operation))
+        self.con.executemany(operation, seq_of_parameters)
+        return self
+
+    def fetchall(self):
+        return self.con.fetchall()
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,388 @@
+import asyncio
+import os
+import posixpath
+import shutil
+from datetime import datetime
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
+
+import aiofiles
+import aiofiles.os
+import pyarrow as pa
+from kelvin.application import KelvinApp, filters
+
+from pipeline import IngestQueue, UploadPipeline
+from query import QueryServer
+from timeseries import BatchId, TimeseriesDataStore
+
+# Destination directory, file name and local file path or in-memory file of an exported part
+Part = Tuple[str, str, Union[str, IO[bytes]]]
+
+
+class Sink:
+    """
+    Destination of an exporter, plugged into the shared buffering and export engine (`run`).
+
+    The engine buffers the asset data messages in a TimeseriesDataStore and runs the pipelined export/upload
+    loop (UploadPipeline), so every sink gets batching, concurrent uploads, adaptive batch sizes, backlog
+    policies and the query endpoint. A sink only exports a batch in its format and uploads it. Most sinks
+    extend FileSink (parquet files) or TableSink (Arrow tables) rather than Sink itself.
+    """
+
+    def get_config(self, key: str, default: Any = None) -> Any:
+        """
+        Reads a configuration value of the app with a default. Replaced by the app configuration before `setup`.
+
+        Args:
+            key (str): The configuration key.
+            default (Any): The value if the key is not configured.
+
+        Returns:
+            Any: The configuration value.
+        """
+        return default
+
+    async def setup(self) -> None:
+        """
+        Prepares the destination before any message is received.
+        """
+
+    async def close(self) -> None:
+        """
+        Releases the clients of the destination on shutdown.
+        """
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the metrics of the destination, served by the query endpoint under /metrics.
+
+        Returns:
+            Dict[str, Any]: The metric values by name.
+        """
+        return {}
+
+    async def export_batch(self, data_store: TimeseriesDataStore, limit: int, after: Optional[int]) -> Tuple[Any, int, Optional[BatchId]]:
+        """
+        Exports the next batch of records from the data store.
+
+        Args:
+            data_store (TimeseriesDataStore): The data store to export from.
+            limit (int): The maximum number of records in the batch.
+            after (Optional[int]): Export the records after this sequence number, None to export from the acknowledged watermark.
+
+        Returns:
+            Tuple[Any, int, Optional[BatchId]]: The exported data, the number of records and the batch id.
+        """
+        raise NotImplementedError
+
+    async def upload_batch(self, data: Any) -> None:
+        """
+        Uploads the data of an exported batch.
+
+        Args:
+            data (Any): The exported data of the batch.
+        """
+        raise NotImplementedError
+
+    async def release_batch(self, data: Any) -> None:
+        """
+        Releases the data of a batch once uploaded or discarded.
+
+        Args:
+            data (Any): The exported data of the batch.
+        """
+
+    def batch_bytes(self, data: Any) -> int:
+        """
+        Returns the size of the data of a batch, used by the adaptive batch size controller.
+
+        Args:
+            data (Any): The exported data of the batch.
+
+        Returns:
+            int: The size in bytes.
+        """
+        raise NotImplementedError
+
+
+class FileSink(Sink):
+    """
+    Sink uploading batches as parquet files.
+
+    Batches are exported to in-memory parquet files, which only spill to the export dir over the
+    'export_memory_limit', or to parquet files under asset=<a>/date=<d>[/hour=<h>] directories when
+    'partition_by' is set. Rollups are uploaded under `rollup_dir`, apart from the raw records.
+    Files are named after the sequence range of their batch, so a batch exported again after a
+    failure or restart overwrites its previous upload. Up to 'upload_file_concurrency' files of a
+    batch are uploaded at once. Subclasses implement `upload` and `upload_stream`.
+
+    Attributes:
+        data_dir (str): The destination directory of the raw records.
+        rollup_dir (str): The destination directory of the rollups.
+    """
+
+    data_dir = ""
+    rollup_dir = "rollup"
+
+    async def upload(self, file_path: str, dest_dir: str = "") -> None:
+        """
+        Uploads a local file.
+
+        Args:
+            file_path (str): The local file path.
+            dest_dir (str): The destination directory of the file.
+        """
+        raise NotImplementedError
+
+    async def upload_stream(self, data: IO[bytes], file_name: str, dest_dir: str = "") -> None:
+        """
+        Uploads the contents of a file object.
+
+        Args:
+            data (IO[bytes]): The file object to upload.
+            file_name (str): The destination file name.
+            dest_dir (str): The destination directory of the file.
+        """
+        raise NotImplementedError
+
+    async def export_batch(self, data_store: TimeseriesDataStore, limit: int, after: Optional[int]):
+        # Create export dir
+        await aiofiles.os.makedirs("export/", exist_ok=True)
+
+        get_config = self.get_config
+
+        partition_by = get_config("partition_by", "none")
+        rollup_mode = get_config("rollup_mode", "none")
+        parquet_options = {
+            "compression": get_config("parquet_compression", "zstd"),
+            "compression_level": get_config("parquet_compression_level"),
+            "row_group_size": get_config("parquet_row_group_size"),
+        }
+
+        async def export_parts(name: str, limit: int, after: Optional[int], rollup: bool, file_size: Optional[int] = None):
+            dest_dir = self.rollup_dir if rollup else self.data_dir
+
+            if partition_by != "none":
+                # Export to parquet files under asset=<a>/date=<d>[/hour=<h>] directories
+                dir_path = f"export/{name}"
+                files, chunk_size, batch_id = await data_store.export_parquet_partitioned(
+                    dir_path=dir_path, limit=limit, after=after, partition_by=partition_by, file_size=file_size, rollup=rollup, **parquet_options
+                )
+                parts = [
+                    (posixpath.join(dest_dir, os.path.relpath(os.path.dirname(file), dir_path).replace(os.sep, "/")), os.path.basename(file), file)
+                    for file in files or []
+                ]
+            else:
+                # Export to an in-memory parquet file, which only spills to the export dir over the memory limit
+                buffer, chunk_size, batch_id = await data_store.export_parquet_buffer(
+                    limit=limit,
+                    after=after,
+                    file_size=file_size,
+                    memory_limit=get_config("export_memory_limit", 67108864),
+                    spill_dir="export/",
+                    rollup=rollup,
+                    **parquet_options,
+                )
+                parts = [(dest_dir, f"{data_store.batch_name(batch_id)}.parquet", buffer)] if buffer is not None else []
+
+            return parts, chunk_size, batch_id
+
+        # Local directory of the partitioned files
+        name = datetime.now().isoformat()
+        parts, chunk_size, batch_id = await export_parts(name, limit, after, rollup=rollup_mode == "rollup", file_size=get_config("parquet_file_size"))
+
+        if batch_id is not None and rollup_mode == "both":
+            # Roll up the same sequence range as the raw batch
+            rollup_parts, _, _ = await export_parts(f"{name}.rollup", batch_id[1] - batch_id[0] + 1, batch_id[0] - 1, rollup=True)
+            parts += rollup_parts
+
+        return ([f"export/{name}", f"export/{name}.rollup"], parts), chunk_size, batch_id
+
+    async def upload_batch(self, data: Tuple[List[str], List[Part]]):
+        _, parts = data
+        semaphore = asyncio.Semaphore(max(1, int(self.get_config("upload_file_concurrency", 1))))
+
+        async def upload_part(dest_dir: str, file_name: str, source: Union[str, IO[bytes]]):
+            async with semaphore:
+                if isinstance(source, str):
+                    await self.upload(file_path=source, dest_dir=dest_dir)
+                else:
+                    await self.upload_stream(source, file_name=file_name, dest_dir=dest_dir)
+
+        tasks = [asyncio.ensure_future(upload_part(*part)) for part in parts]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the other uploads of the batch, which is uploaded again as a whole
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def release_batch(self, data: Tuple[List[str], List[Part]]):
+        # Close in-memory files, and remove partition directories if exist
+        export_dirs, parts = data
+        for _, _, source in parts:
+            if not isinstance(source, str):
+                source.close()
+
+        for export_dir in export_dirs:
+            if await aiofiles.os.path.isdir(export_dir):
+                await asyncio.to_thread(shutil.rmtree, export_dir)
+
+    def batch_bytes(self, data: Tuple[List[str], List[Part]]) -> int:
+        _, parts = data
+        return sum(os.path.getsize(source) if isinstance(source, str) else source.seek(0, os.SEEK_END) for _, _, source in parts)
+
+
+class TableSink(Sink):
+    """
+    Sink uploading batches as Arrow tables. Subclasses implement `upload`.
+
+    Tables are uploaded along with the name of their batch, which is the same when a batch is
+    exported again after a failure or restart, so sinks staging files can overwrite them.
+    """
+
+    async def upload(self, table: pa.Table, rollup: bool = False, name: str = "") -> None:
+        """
+        Uploads an Arrow table.
+
+        Args:
+            table (pa.Table): The records to upload.
+            rollup (bool): Whether the table holds rollups rather than raw records.
+            name (str): The name of the batch of the table, with a '.rollup' suffix for the rollups of 'both' rollup mode.
+        """
+        raise NotImplementedError
+
+    async def export_batch(self, data_store: TimeseriesDataStore, limit: int, after: Optional[int]):
+        rollup_mode = self.get_config("rollup_mode", "none")
+
+        table, chunk_size, batch_id = await data_store.export_arrow(limit=limit, after=after, rollup=rollup_mode == "rollup")
+        tables = [(table, rollup_mode == "rollup", data_store.batch_name(batch_id))] if table is not None else []
+
+        if batch_id is not None and rollup_mode == "both":
+            # Roll up the same sequence range as the raw batch
+            rollups, _, _ = await data_store.export_arrow(limit=batch_id[1] - batch_id[0] + 1, after=batch_id[0] - 1, rollup=True)
+            tables.append((rollups, True, f"{data_store.batch_name(batch_id)}.rollup"))
+
+        return tables, chunk_size, batch_id
+
+    async def upload_batch(self, data: List[Tuple[pa.Table, bool, str]]):
+        for table, rollup, name in data:
+            await self.upload(table, rollup=rollup, name=name)
+
+    def batch_bytes(self, data: List[Tuple[pa.Table, bool, str]]) -> int:
+        return sum(table.nbytes for table, _, _ in data)
+
+
+async def run(sink: Sink) -> None:
+    """
+    Runs an exporter: buffers the asset data messages in the local data store, and continuously
+    exports and uploads them to the sink.
+
+    Args:
+        sink (Sink): The destination of the exporter.
+    """
+    # Creating instance of Kelvin App Client
+    app = KelvinApp()
+
+    # Connect the App Client
+    await app.connect()
+
+    # Configure the destination
+    sink.get_config = app.app_configuration.get
+    await sink.setup()
+
+    # Configure the Timeseries Database
+    data_store = TimeseriesDataStore(
+        db_path="data.db",
+        flush_size=app.app_configuration.get("flush_size", 1000),
+        flush_interval=app.app_configuration.get("flush_interval", 1),
+        segment_size=app.app_configuration.get("segment_size", 100000),
+        segment_interval=app.app_configuration.get("segment_interval", 3600),
+        max_bytes=app.app_configuration.get("max_bytes"),
+        max_age=app.app_configuration.get("max_age"),
+        append_only=app.app_configuration.get("append_only", False),
+        rollup_interval=app.app_configuration.get("rollup_interval", 60),
+        rollup_aggregates=app.app_configuration.get("rollup_aggregates"),
+        backlog_policy=app.app_configuration.get("backlog_policy", "none"),
+        backlog_metric=app.app_configuration.get("backlog_metric", "bytes"),
+        backlog_high_watermark=app.app_configuration.get("backlog_high_watermark"),
+        backlog_low_watermark=app.app_configuration.get("backlog_low_watermark"),
+        downsample_interval=app.app_configuration.get("downsample_interval", 60),
+        db_threads=app.app_configuration.get("db_threads"),
+        db_memory_limit=app.app_configuration.get("db_memory_limit"),
+        db_temp_directory=app.app_configuration.get("db_temp_directory"),
+    )
+    await data_store.setup()
+
+    # Decouple the stream consumer from the inserts into the local data store
+    ingest_queue = IngestQueue(
+        data_store,
+        max_size=int(app.app_configuration.get("ingest_queue_size", 10000)),
+        full_policy=app.app_configuration.get("ingest_full_policy", "block"),
+    )
+    ingest_queue.start()
+
+    # Export and upload the buffered data
+    pipeline = UploadPipeline(
+        data_store,
+        export=lambda limit, after: sink.export_batch(data_store, limit, after),
+        upload=sink.upload_batch,
+        cleanup=sink.release_batch,
+        size=sink.batch_bytes,
+    )
+
+    def metrics() -> Dict[str, Any]:
+        # The metrics of the sink, along with those of the ingest queue, the local buffer flushes and the upload pipeline
+        return dict(
+            sink.metrics(),
+            ingest=ingest_queue.metrics(),
+            flush={
+                "flush_count": data_store.flush_count,
+                "last_flush_rows": data_store.last_flush_rows,
+                "last_flush_latency": data_store.last_flush_latency,
+            },
+            pipeline=pipeline.metrics(),
+        )
+
+    # Serve time range queries over the local buffer, if enabled
+    query_server = None
+    if app.app_configuration.get("query_port"):
+        query_server = QueryServer(
+            data_store,
+            host=app.app_configuration.get("query_host", "127.0.0.1"),
+            port=int(app.app_configuration.get("query_port")),
+            metrics=metrics,
+        )
+        await query_server.start()
+
+    # Create task to continuously upload data
+    pipeline_task = asyncio.create_task(pipeline.run(app.app_configuration.get))
+
+    def report_failure(task: asyncio.Task):
+        # The upload loop handles its errors, so this only reports an unexpected failure
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Upload pipeline failed: {task.exception()!r}")
+
+    pipeline_task.add_done_callback(report_failure)
+
+    try:
+        # Subscribe to the asset data streams
+        async for msg in app.stream_filter(filters.is_asset_data_message):
+            # Queue msg for the writer of the local data store
+            await ingest_queue.put(timestamp=msg.timestamp, asset=msg.resource.asset, datastream=msg.resource.data_stream, payload=msg.payload)
+    finally:
+        if query_server is not None:
+            await query_server.close()
+
+        # Insert the queued msgs
+        await ingest_queue.close()
+
+        # Stop exporting before the data store and the sink close
+        pipeline_task.cancel()
+        await asyncio.gather(pipeline_task, return_exceptions=True)
+
+        # Flush buffered msgs to local data store
+        await data_store.close()
+
+        await sink.close()
@@ -0,0 +1,57 @@
+"""
+Copies the shared exporter core into every exporter.
+
+The Docker build context of an exporter is its own directory, so each exporter ships a copy of the
+modules of this directory. The copies are generated: edit the modules here, then run this script.
+
+Usage:
+    python3 sync.py           # update the copies
+    python3 sync.py --check   # fail if a copy is out of date
+"""
+
+import argparse
+import os
+import sys
+
+COMMON_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPORTERS_DIR = os.path.dirname(COMMON_DIR)
+EXPORTERS = ["aws-s3-uploader", "azure-data-lake-uploader", "databricks-volume-uploader", "databricks-delta-table-uploader"]
+MODULES = ["exporter.py", "pipeline.py", "query.py", "timeseries.py"]
+
+HEADER = "# Generated from exporters/common/{module} by common/sync.py, do not edit.\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the shared exporter core into every exporter.")
+    parser.add_argument("--check", action="store_true", help="Fail if a copy is out of date instead of updating it.")
+    args = parser.parse_args()
+
+    stale = []
+    for module in MODULES:
+        with open(os.path.join(COMMON_DIR, module)) as f:
+            source = HEADER.format(module=module) + f.read()
+
+        for exporter in EXPORTERS:
+            path = os.path.join(EXPORTERS_DIR, exporter, module)
+            current = None
+            if os.path.exists(path):
+                with open(path) as f:
+                    current = f.read()
+
+            if current == source:
+                continue
+
+            stale.append(os.path.relpath(path, EXPORTERS_DIR))
+            if not args.check:
+                with open(path, "w") as f:
+                    f.write(source)
+
+    if args.check and stale:
+        sys.exit(f"Out of date, run common/sync.py: {', '.join(stale)}")
+
+    for path in stale:
+        print(f"Updated {path}")
+
+
+if __name__ == "__main__":
+    main()
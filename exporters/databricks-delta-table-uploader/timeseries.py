@@ -1,60 +1,901 @@
+# Generated from exporters/common/timeseries.py by common/sync.py, do not edit.
 import asyncio
-from datetime import datetime
-from typing import Dict, Optional, Tuple, Union
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import IO, TYPE_CHECKING, Deque, Dict, List, Optional, Tuple, Union
 
 import duckdb
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Keeps the last written record of each primary key when exporting append-only segments
+DEDUPLICATE = "QUALIFY row_number() OVER (PARTITION BY timestamp, asset, datastream ORDER BY seq DESC) = 1"
+
+# Identifies an exported batch by its inclusive (first, last) ingest sequence range
+BatchId = Tuple[int, int]
+
+# Delivery states of the batches recorded in the batch manifest, in order
+BATCH_STATES = ["exported", "uploaded", "acked"]
+
+# Type tag of a record's payload, which is stored in the column of its type: `payload` (DOUBLE),
+# `payload_string` or `payload_boolean`. Only batches with non-numeric payloads export the typed columns.
+PAYLOAD_TYPE = "ENUM('number', 'string', 'boolean')"
+TYPED_PAYLOAD_COLUMNS = ["payload_type", "payload_string", "payload_boolean"]
+
+# Rollup aggregates of the numeric payload, exported as `payload_<name>` columns
+ROLLUP_AGGREGATES = {
+    "min": "min(payload)",
+    "max": "max(payload)",
+    "mean": "avg(payload)",
+    "last": "arg_max(payload, timestamp) FILTER (payload IS NOT NULL)",
+    "count": "count(payload)",
+}
+
+# Policies applied while the backlog is above the high watermark, and the backlog metrics the watermarks apply to with their unit
+BACKLOG_POLICIES = ["none", "drop_oldest", "downsample", "stop_ingest"]
+BACKLOG_METRICS = {"rows": "records", "bytes": "bytes", "age": "seconds"}
+
+# Errors of an invalid record, which is skipped rather than failing the flush of the other records
+RECORD_ERRORS = (duckdb.DataError, duckdb.IntegrityError, duckdb.InvalidInputException)
+
+# Hive partition columns derived from the record timestamp, by partition granularity
+PARTITIONS = {
+    "day": {"date": "strftime(timestamp, '%Y-%m-%d')"},
+    "hour": {"date": "strftime(timestamp, '%Y-%m-%d')", "hour": "strftime(timestamp, '%H')"},
+}
+
+
+class Segment:
+    """
+    A segment of the timeseries buffer, stored in its own `timeseries_<id>` table.
+
+    Only the newest segment is active and receives inserts. Once sealed, a segment covers the
+    fixed sequence range `first_seq` to `last_seq` and is dropped as a whole when acknowledged.
+
+    Attributes:
+        id (int): The segment identifier.
+        created_at (datetime): When the segment was created.
+        sealed_at (Optional[datetime]): When the segment was sealed, None while it is active.
+        first_seq (int): The lowest sequence number the segment can hold.
+        last_seq (Optional[int]): The highest sequence number in the segment, None while it is active.
+        rows (int): The approximate number of records written to the segment.
+        append_only (bool): Whether the segment table has no primary key and keeps duplicate records.
+        downsampled (bool): Whether the segment records were downsampled to relieve the backlog.
+        min_timestamp (Optional[datetime]): The lowest record timestamp in the segment, None if unknown.
+        max_timestamp (Optional[datetime]): The highest record timestamp in the segment, None if unknown.
+    """
+
+    def __init__(
+        self,
+        id: int,
+        created_at: datetime,
+        first_seq: int,
+        sealed_at: Optional[datetime] = None,
+        last_seq: Optional[int] = None,
+        rows: int = 0,
+        append_only: bool = False,
+        downsampled: bool = False,
+        min_timestamp: Optional[datetime] = None,
+        max_timestamp: Optional[datetime] = None,
+    ):
+        self.id = id
+        self.created_at = created_at
+        self.sealed_at = sealed_at
+        self.first_seq = first_seq
+        self.last_seq = last_seq
+        self.rows = rows
+        self.append_only = append_only
+        self.downsampled = downsampled
+        self.min_timestamp = min_timestamp
+        self.max_timestamp = max_timestamp
+
+    @property
+    def table(self) -> str:
+        return f"timeseries_{self.id}"
+
+    def overlaps(self, start: Optional[datetime], end: Optional[datetime]) -> bool:
+        """
+        Returns whether the segment may hold records in a time window.
+
+        Args:
+            start (Optional[datetime]): The inclusive start of the window, None if unbounded.
+            end (Optional[datetime]): The exclusive end of the window, None if unbounded.
+
+        Returns:
+            bool: False if the record timestamps of the segment are known to be outside of the window.
+        """
+        if self.min_timestamp is None or self.max_timestamp is None:
+            return True
+
+        return (start is None or self.max_timestamp >= start) and (end is None or self.min_timestamp < end)
+
+    @property
+    def sealed(self) -> bool:
+        return self.sealed_at is not None
 
 
 class TimeseriesDataStore:
     """
     A class to manage a time series database using DuckDB. It supports asynchronous
-    operations for setting up the database, inserting data, exporting data, and trimming
-    old data.
+    operations for setting up the database, inserting data, exporting data, and acknowledging
+    exported data.
+
+    Every record is stamped with a monotonically increasing ingest sequence number. Exports
+    read a contiguous sequence range after a watermark and return it as a batch id, and
+    acknowledging the batch id advances the acknowledged watermark past that range. Records
+    updated after being exported receive a new sequence number, so they are exported again
+    instead of being covered by the acknowledgement.
+
+    Records are written into rotating segment tables. The active segment is sealed once it
+    holds `segment_size` records or is `segment_interval` seconds old, and a sealed segment is
+    dropped outright once all of its records are acknowledged, so the backlog is never trimmed
+    row by row. Sealed segments are also dropped, acknowledged or not, when the database grows
+    beyond `max_bytes` or when they are older than `max_age` seconds. The upsert only resolves
+    duplicates within the active segment.
+
+    With `append_only`, segment tables are created without the primary key index and records
+    are appended without the upsert. Duplicates are then resolved at export time, keeping the
+    last written record of each (timestamp, asset, datastream) within the exported batch.
+
+    Exports can roll a batch up instead of returning raw records: DuckDB aggregates the numeric
+    payloads per asset, datastream and `rollup_interval` seconds into the `rollup_aggregates`.
+    An interval spanning two batches is exported as a partial rollup in each of them.
+
+    The backlog of unacknowledged records is accounted incrementally after every flush and
+    acknowledgement, without scanning the segments: its number of records (estimated from the
+    segment record counts and sequence ranges), the used size of the database and the age of its
+    oldest record. Once the `backlog_metric` reaches `backlog_high_watermark`, the `backlog_policy`
+    applies until it is back under `backlog_low_watermark`: 'drop_oldest' drops the oldest segments,
+    'downsample' keeps only the last record per asset, datastream and `downsample_interval` seconds
+    of the oldest segments (then drops them once all are downsampled), and 'stop_ingest' discards
+    incoming records.
+
+    Records can also be read by time range without exporting them: `query` selects the records of
+    an asset (and datastream) in a time window, skipping the segments whose timestamp bounds are
+    outside of the window. Queries run on their own thread and cursor, so they read a consistent
+    snapshot without blocking inserts, exports or acknowledgements.
+
+    The store keeps a single long-lived database connection and hands out one cursor per
+    thread, so operations do not pay for reopening the database file. The connection is
+    re-established if the database file is removed while the store is running. The connection
+    is opened with the `db_threads`, `db_memory_limit` and `db_temp_directory` settings, which
+    bound the cores and memory DuckDB uses for exports, spilling large sorts to the temporary
+    directory instead of competing with the other processes of the gateway.
+
+    Inserted records are collected in an in-memory buffer and written to the database
+    in micro-batches, either when the buffer reaches `flush_size` records or every
+    `flush_interval` seconds, whichever comes first.
 
     Attributes:
         db_path (str): The file path to the DuckDB database. Defaults to in-memory database.
+        flush_size (int): The number of buffered records that triggers a flush.
+        flush_interval (float): The maximum number of seconds a record stays in the buffer.
+        flush_count (int): The number of flushes performed so far.
+        last_flush_rows (int): The number of records written by the last flush.
+        last_flush_latency (float): The duration in seconds of the last flush.
+        last_flush_time (Optional[float]): The `time.perf_counter()` time the last flush completed.
+        buffer_generation (int): The generation of the buffered records, incremented when a flush takes the buffer.
+        flushed_generation (int): The records buffered in a lower generation are written to the database.
+        segment_size (int): The number of records that seals the active segment.
+        segment_interval (float): The number of seconds after which the active segment is sealed.
+        max_bytes (Optional[int]): The database size in bytes above which the oldest segments are dropped.
+        max_age (Optional[float]): The number of seconds after which sealed segments are dropped.
+        append_only (bool): Whether new segments are append-only tables without the primary key upsert.
+        rollup_interval (float): The length in seconds of the rollup intervals.
+        rollup_aggregates (List[str]): The rollup aggregates ('min', 'max', 'mean', 'last' and 'count').
+        backlog_policy (str): The policy applied above the high watermark ('none', 'drop_oldest', 'downsample' or 'stop_ingest').
+        backlog_metric (str): The backlog metric the watermarks apply to ('rows', 'bytes' or 'age' in seconds).
+        backlog_high_watermark (Optional[float]): The backlog metric value from which the policy applies.
+        backlog_low_watermark (Optional[float]): The backlog metric value under which the policy stops applying.
+        downsample_interval (float): The length in seconds of the intervals the 'downsample' policy keeps a record of.
+        db_threads (Optional[int]): The number of threads DuckDB uses.
+        db_memory_limit (Optional[int]): The number of bytes of memory DuckDB uses before spilling to the temporary directory.
+        db_temp_directory (Optional[str]): The directory DuckDB spills to.
+        backlog_rows (int): The approximate number of unacknowledged records.
+        backlog_bytes (int): The used size of the database in bytes.
+        backlog_age (float): The number of seconds since the oldest unacknowledged record was flushed.
+        backlog_exceeded (bool): Whether the backlog policy is applying.
+        dropped_records (int): The number of incoming records discarded by the 'stop_ingest' policy.
+        store_id (Optional[str]): The random identifier of the database, which names its batches apart from those of a previous database.
     """
 
-    def __init__(self, db_path: str = ":memory:"):
+    def __init__(
+        self,
+        db_path: str = ":memory:",
+        flush_size: int = 1000,
+        flush_interval: float = 1.0,
+        segment_size: int = 100_000,
+        segment_interval: float = 3600,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        append_only: bool = False,
+        rollup_interval: float = 60,
+        rollup_aggregates: Optional[List[str]] = None,
+        backlog_policy: str = "none",
+        backlog_metric: str = "bytes",
+        backlog_high_watermark: Optional[float] = None,
+        backlog_low_watermark: Optional[float] = None,
+        downsample_interval: float = 60,
+        db_threads: Optional[int] = None,
+        db_memory_limit: Optional[int] = None,
+        db_temp_directory: Optional[str] = None,
+    ):
         """
         Initializes the TimeseriesDataStore with a database path.
 
         Args:
             db_path (str): The path to the DuckDB database file. Defaults to in-memory database.
+            flush_size (int): The number of buffered records that triggers a flush. Defaults to 1000.
+            flush_interval (float): The maximum number of seconds a record stays in the buffer. Defaults to 1 second.
+            segment_size (int): The number of records that seals the active segment. Defaults to 100000.
+            segment_interval (float): The number of seconds after which the active segment is sealed. Defaults to 1 hour.
+            max_bytes (Optional[int]): The database size in bytes above which the oldest segments are dropped. Defaults to no limit.
+            max_age (Optional[float]): The number of seconds after which sealed segments are dropped. Defaults to no limit.
+            append_only (bool): Whether new segments are append-only tables without the primary key upsert. Defaults to False.
+            rollup_interval (float): The length in seconds of the rollup intervals. Defaults to 1 minute.
+            rollup_aggregates (Optional[List[str]]): The rollup aggregates ('min', 'max', 'mean', 'last' and 'count'). Defaults to all of them.
+            backlog_policy (str): The policy applied above the high watermark ('none', 'drop_oldest', 'downsample' or 'stop_ingest'). Defaults to 'none'.
+            backlog_metric (str): The backlog metric the watermarks apply to ('rows', 'bytes' or 'age' in seconds). Defaults to 'bytes'.
+            backlog_high_watermark (Optional[float]): The backlog metric value from which the policy applies. Defaults to no limit.
+            backlog_low_watermark (Optional[float]): The backlog metric value under which the policy stops applying. Defaults to 80% of the high watermark.
+            downsample_interval (float): The length in seconds of the intervals the 'downsample' policy keeps a record of. Defaults to 1 minute.
+            db_threads (Optional[int]): The number of threads DuckDB uses. Defaults to the number of cores.
+            db_memory_limit (Optional[int]): The number of bytes of memory DuckDB uses before spilling to the temporary directory. Defaults to 80% of the RAM.
+            db_temp_directory (Optional[str]): The directory DuckDB spills to. Defaults to '<db_path>.tmp'.
+
+        Raises:
+            ValueError: If a rollup aggregate, the backlog policy or the backlog metric is not supported.
         """
         self.db_path = db_path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.segment_size = segment_size
+        self.segment_interval = segment_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.append_only = append_only
+        self.rollup_interval = rollup_interval
+        self.rollup_aggregates = list(ROLLUP_AGGREGATES) if rollup_aggregates is None else list(rollup_aggregates)
+
+        unknown = set(self.rollup_aggregates) - set(ROLLUP_AGGREGATES)
+        if unknown:
+            raise ValueError(f"Invalid rollup aggregates {sorted(unknown)}, expected any of {list(ROLLUP_AGGREGATES)}")
+
+        if backlog_policy not in BACKLOG_POLICIES:
+            raise ValueError(f"Invalid backlog policy '{backlog_policy}', expected one of {BACKLOG_POLICIES}")
+        if backlog_metric not in BACKLOG_METRICS:
+            raise ValueError(f"Invalid backlog metric '{backlog_metric}', expected one of {list(BACKLOG_METRICS)}")
+
+        self.backlog_policy = backlog_policy
+        self.backlog_metric = backlog_metric
+        self.backlog_high_watermark = backlog_high_watermark
+        self.backlog_low_watermark = backlog_low_watermark if backlog_low_watermark is not None else (backlog_high_watermark or 0) * 0.8
+        self.downsample_interval = downsample_interval
+        self.db_threads = db_threads
+        self.db_memory_limit = db_memory_limit
+        self.db_temp_directory = db_temp_directory
+
+        self.backlog_rows = 0
+        self.backlog_bytes = 0
+        self.backlog_age = 0.0
+        self.backlog_exceeded = False
+        self.dropped_records = 0
+        self.store_id: Optional[str] = None
+
+        self.flush_count = 0
+        self.last_flush_rows = 0
+        self.last_flush_latency = 0.0
+        self.last_flush_time: Optional[float] = None
+        self.buffer_generation = 0
+        self.flushed_generation = 0
+
+        # Pending records keyed by primary key, so the last write wins like the ON CONFLICT upsert
+        self._buffer: Dict[Tuple[datetime, str, str], Union[float, str, bool]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # Long-lived connection shared by the per-thread cursors
+        self._con: Optional[duckdb.DuckDBPyConnection] = None
+        self._con_lock = threading.Lock()
+        self._con_generation = 0
+        self._local = threading.local()
+
+        # Highest sequence number acknowledged and highest sequence number committed to the database
+        self._ack_seq = 0
+        self._max_seq = 0
+
+        # Segments ordered from oldest to newest, the last one being the active segment
+        self._segments: List[Segment] = []
+        self._segments_lock = threading.RLock()
+
+        # Single thread for time range queries, so they never wait on nor occupy the threads of the ingest and upload paths
+        self._query_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="timeseries-query")
+
+        # Flush time of the committed sequence ranges not yet acknowledged, as (last seq, flushed at) from oldest to newest
+        self._ingested: Deque[Tuple[int, datetime]] = deque()
+
+        # Size of the last Parquet export, used to size batches by a target file size
+        self._parquet_bytes_per_row: Optional[float] = None
+
+        # Batch manifest: last sequence number and delivery state of the exported batches, by first sequence number
+        self._batches: Dict[int, Tuple[int, str]] = {}
 
     async def setup(self):
         """
-        Asynchronously sets up the database by creating the `timeseries` table if it does not exist.
+        Asynchronously sets up the database by creating the timeseries segments if they do not exist
+        and starts the periodic buffer flush.
         """
         await asyncio.to_thread(self._setup)
 
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """
+        Asynchronously stops the periodic buffer flush, writes any pending records to the database
+        and closes the database connection.
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        await self.flush()
+        self._query_executor.shutdown(wait=False, cancel_futures=True)
+        await asyncio.to_thread(self._close)
+
+    def _close(self):
+        """
+        Synchronously closes the database connection. Cursors held by other threads become invalid
+        and are replaced on their next use.
+        """
+        with self._con_lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+                self._con_generation += 1
+
+        print(f"Closed timeseries database: '{self.db_path}'")
+
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        """
+        Returns the cursor of the calling thread, (re)connecting to the database when needed.
+
+        Results read from these cursors are always fully fetched, as a partially fetched result keeps
+        its transaction open and prevents the database from checkpointing.
+
+        Returns:
+            duckdb.DuckDBPyConnection: A cursor on the long-lived database connection.
+        """
+        with self._con_lock:
+            if self._con is not None and self.db_path != ":memory:" and not os.path.exists(self.db_path):
+                print(f"Timeseries database file '{self.db_path}' was lost, reconnecting")
+                self._con.close()
+                self._con = None
+                self._con_generation += 1
+
+            if self._con is None:
+                self._con = duckdb.connect(self.db_path, config=self._config())
+                self._create_tables(self._con)
+                self._load_segments(self._con)
+
+            if getattr(self._local, "generation", None) != self._con_generation:
+                self._local.cursor = self._con.cursor()
+                self._local.generation = self._con_generation
+
+            return self._local.cursor
+
+    def _config(self) -> Dict[str, Union[int, str]]:
+        """
+        Returns the DuckDB settings the database connection is opened with.
+
+        Returns:
+            Dict[str, Union[int, str]]: The settings that are configured.
+        """
+        config: Dict[str, Union[int, str]] = {}
+        if self.db_threads:
+            config["threads"] = int(self.db_threads)
+        if self.db_memory_limit:
+            config["memory_limit"] = f"{int(self.db_memory_limit)}B"
+        if self.db_temp_directory:
+            config["temp_directory"] = self.db_temp_directory
+
+        return config
+
     def _setup(self):
         """
-        Synchronously sets up the database by creating the `timeseries` table if it does not exist.
+        Synchronously sets up the database by creating the timeseries segments if they do not exist.
         """
         print(f"Setting up timeseries database: '{self.db_path}'")
 
-        with duckdb.connect(self.db_path) as con:
+        # Connecting creates the tables if they do not exist
+        self._cursor()
+
+        print(f"Successfully created timeseries database: '{self.db_path}'")
+
+    def _create_tables(self, con: duckdb.DuckDBPyConnection):
+        """
+        Creates the ingest sequence, the segment catalog, the acknowledged watermark and the batch
+        manifest if they do not exist. A `timeseries` table created by previous versions becomes the first sealed segment.
+
+        The sequence starts after the highest sequence number seen by this store, so batch ids
+        exported before the database file was lost never match records inserted afterwards.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+        """
+        con.execute(f"CREATE SEQUENCE IF NOT EXISTS timeseries_seq START WITH {self._max_seq + 1}")
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS timeseries_segments (
+                id BIGINT PRIMARY KEY,
+                created_at DATETIME,
+                sealed_at DATETIME,
+                first_seq BIGINT,
+                last_seq BIGINT
+            )
+            """
+        )
+        con.execute("ALTER TABLE timeseries_segments ADD COLUMN IF NOT EXISTS append_only BOOLEAN DEFAULT false")
+        con.execute("ALTER TABLE timeseries_segments ADD COLUMN IF NOT EXISTS rows BIGINT")
+        con.execute("ALTER TABLE timeseries_segments ADD COLUMN IF NOT EXISTS downsampled BOOLEAN DEFAULT false")
+        con.execute("ALTER TABLE timeseries_segments ADD COLUMN IF NOT EXISTS min_timestamp DATETIME")
+        con.execute("ALTER TABLE timeseries_segments ADD COLUMN IF NOT EXISTS max_timestamp DATETIME")
+        con.execute("CREATE TABLE IF NOT EXISTS timeseries_watermark (ack_seq BIGINT)")
+        con.execute("CREATE TABLE IF NOT EXISTS timeseries_store (store_id VARCHAR)")
+        con.execute("CREATE TABLE IF NOT EXISTS timeseries_batches (first_seq BIGINT PRIMARY KEY, last_seq BIGINT, state VARCHAR, updated_at DATETIME)")
+
+        (legacy,) = con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = 'timeseries'").fetchall()[0]
+        if legacy:
+            print("Migrating 'timeseries' table into the first timeseries segment")
+
+            con.execute("ALTER TABLE timeseries ADD COLUMN IF NOT EXISTS seq BIGINT DEFAULT nextval('timeseries_seq')")
+            min_seq, max_seq = con.execute("SELECT min(seq), max(seq) FROM timeseries").fetchall()[0]
+
+            if min_seq is None:
+                con.execute("DROP TABLE timeseries")
+            else:
+                now = datetime.now()
+                con.execute("ALTER TABLE timeseries RENAME TO timeseries_0")
+                con.execute(
+                    "INSERT INTO timeseries_segments (id, created_at, sealed_at, first_seq, last_seq) VALUES (0, ?, ?, ?, ?)", (now, now, min_seq, max_seq)
+                )
+                con.execute("DELETE FROM timeseries_watermark")
+                con.execute("INSERT INTO timeseries_watermark VALUES (?)", (min_seq - 1,))
+
+    def _load_segments(self, con: duckdb.DuckDBPyConnection):
+        """
+        Loads the segment catalog, the sequence watermarks and the batch manifest, creating the active segment if there is none.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+        """
+        with self._segments_lock:
+            self._segments = [
+                Segment(
+                    id=id,
+                    created_at=created_at,
+                    sealed_at=sealed_at,
+                    first_seq=first_seq,
+                    last_seq=last_seq,
+                    rows=rows or 0,
+                    append_only=append_only,
+                    downsampled=downsampled,
+                    min_timestamp=min_timestamp,
+                    max_timestamp=max_timestamp,
+                )
+                for id, created_at, sealed_at, first_seq, last_seq, rows, append_only, downsampled, min_timestamp, max_timestamp in con.execute(
+                    """
+                    SELECT id, created_at, sealed_at, first_seq, last_seq, rows, append_only, downsampled, min_timestamp, max_timestamp
+                    FROM timeseries_segments
+                    ORDER BY id
+                    """
+                ).fetchall()
+            ]
+
+            for segment in self._segments:
+                self._migrate_payload(con, segment)
+
+                if segment.sealed:
+                    self._max_seq = max(self._max_seq, segment.last_seq)
+                    if not segment.rows:
+                        # Segments sealed by previous versions have no record count, estimate it from their sequence range
+                        segment.rows = segment.last_seq - segment.first_seq + 1
+                else:
+                    rows, max_seq, segment.min_timestamp, segment.max_timestamp = con.execute(
+                        f"SELECT count(*), max(seq), min(timestamp), max(timestamp) FROM {segment.table}"
+                    ).fetchall()[0]
+                    segment.rows = rows
+                    self._max_seq = max(self._max_seq, max_seq or 0)
+
+            watermark = con.execute("SELECT ack_seq FROM timeseries_watermark").fetchall()
+            if not watermark:
+                # Nothing was exported from this database yet, which starts after every sequence number seen so far
+                self._ack_seq = self._segments[0].first_seq - 1 if self._segments else self._max_seq
+                con.execute("INSERT INTO timeseries_watermark VALUES (?)", (self._ack_seq,))
+            else:
+                ((self._ack_seq,),) = watermark
+
+            store = con.execute("SELECT store_id FROM timeseries_store").fetchall()
+            if not store:
+                store = [(uuid.uuid4().hex[:8],)]
+                con.execute("INSERT INTO timeseries_store (store_id) VALUES (?)", store[0])
+            ((self.store_id,),) = store
+
+            self._batches = {
+                first_seq: (last_seq, state)
+                for first_seq, last_seq, state in con.execute("SELECT first_seq, last_seq, state FROM timeseries_batches ORDER BY first_seq").fetchall()
+            }
+
+            if not self._segments or self._segments[-1].sealed:
+                self._create_segment(con)
+            elif self._segments[-1].append_only != self.append_only:
+                # Start a segment with the configured table layout
+                self._rotate(con)
+
+            # Records flushed before a restart are accounted as old as their segment
+            self._ingested = deque((segment.last_seq if segment.sealed else self._max_seq, segment.created_at) for segment in self._segments)
+            self._update_backlog(con)
+
+    @staticmethod
+    def _migrate_payload(con: duckdb.DuckDBPyConnection, segment: Segment):
+        """
+        Migrates a segment table created by previous versions to the typed payload columns. A `payload`
+        UNION column is split into the typed columns, and numeric payloads stay in `payload`.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            segment (Segment): The segment to migrate.
+        """
+        columns = dict(con.execute("SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = ?", (segment.table,)).fetchall())
+        if "payload_type" in columns:
+            return
+
+        print(f"Migrating timeseries segment '{segment.table}' to typed payload columns")
+
+        con.execute(f"ALTER TABLE {segment.table} ADD COLUMN payload_type {PAYLOAD_TYPE} DEFAULT 'number'")
+        con.execute(f"ALTER TABLE {segment.table} ADD COLUMN payload_string STRING")
+        con.execute(f"ALTER TABLE {segment.table} ADD COLUMN payload_boolean BOOLEAN")
+
+        if columns["payload"].startswith("UNION"):
             con.execute(
+                f"""
+                UPDATE {segment.table} SET
+                    payload_type = union_tag(payload)::VARCHAR,
+                    payload_string = union_extract(payload, 'string'),
+                    payload_boolean = union_extract(payload, 'boolean')
                 """
-                CREATE TABLE IF NOT EXISTS timeseries (
-                    timestamp DATETIME, 
-                    asset STRING, 
-                    datastream STRING, 
-                    payload UNION(number DOUBLE, string VARCHAR, boolean BOOLEAN),
-                    PRIMARY KEY (timestamp, asset, datastream)
+            )
+            con.execute(f"ALTER TABLE {segment.table} ALTER payload TYPE DOUBLE USING union_extract(payload, 'number')")
+
+    def _create_segment(self, con: duckdb.DuckDBPyConnection):
+        """
+        Creates a new active segment following the newest segment.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+        """
+        segment = Segment(
+            id=self._segments[-1].id + 1 if self._segments else 1,
+            created_at=datetime.now(),
+            first_seq=self._max_seq + 1,
+            append_only=self.append_only,
+        )
+
+        con.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {segment.table} (
+                timestamp DATETIME, 
+                asset STRING, 
+                datastream STRING, 
+                payload DOUBLE,
+                payload_type {PAYLOAD_TYPE} DEFAULT 'number',
+                payload_string STRING,
+                payload_boolean BOOLEAN,
+                seq BIGINT DEFAULT nextval('timeseries_seq')
+                {'' if segment.append_only else ', PRIMARY KEY (timestamp, asset, datastream)'}
+            )
+            """
+        )
+        con.execute(
+            "INSERT INTO timeseries_segments (id, created_at, first_seq, append_only) VALUES (?, ?, ?, ?)",
+            (segment.id, segment.created_at, segment.first_seq, segment.append_only),
+        )
+
+        self._segments.append(segment)
+        print(f"Created timeseries segment '{segment.table}'")
+
+    def _rotate(self, con: duckdb.DuckDBPyConnection):
+        """
+        Seals the active segment and creates a new active segment.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+        """
+        segment = self._segments[-1]
+        segment.sealed_at = datetime.now()
+        segment.last_seq = max(self._max_seq, segment.first_seq - 1)
+
+        con.execute(
+            "UPDATE timeseries_segments SET sealed_at = ?, last_seq = ?, rows = ?, min_timestamp = ?, max_timestamp = ? WHERE id = ?",
+            (segment.sealed_at, segment.last_seq, segment.rows, segment.min_timestamp, segment.max_timestamp, segment.id),
+        )
+        print(f"Sealed timeseries segment '{segment.table}' with {segment.rows} records")
+
+        self._create_segment(con)
+
+    def _drop_segment(self, con: duckdb.DuckDBPyConnection, segment: Segment):
+        """
+        Drops a sealed segment and its records.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            segment (Segment): The sealed segment to drop.
+        """
+        con.execute(f"DROP TABLE IF EXISTS {segment.table}")
+        con.execute("DELETE FROM timeseries_segments WHERE id = ?", (segment.id,))
+
+        self._segments.remove(segment)
+        print(f"Dropped timeseries segment '{segment.table}'")
+
+    def _enforce_retention(self, con: duckdb.DuckDBPyConnection):
+        """
+        Drops the oldest segments, acknowledged or not, that are older than `max_age` or while the
+        database is larger than `max_bytes`.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+        """
+        with self._segments_lock:
+            if self.max_age:
+                cutoff = datetime.now() - timedelta(seconds=self.max_age)
+
+                for segment in [segment for segment in self._segments if segment.sealed and segment.sealed_at < cutoff]:
+                    self._discard_segment(con, segment, reason=f"it is older than {self.max_age} seconds")
+
+            database_bytes = self._database_bytes(con) if self.max_bytes else 0
+            previous_bytes = None
+
+            while self.max_bytes and database_bytes > self.max_bytes:
+                try:
+                    # Move the write-ahead log into compressed blocks and release dropped segments before measuring
+                    con.execute("CHECKPOINT")
+                except duckdb.Error:
+                    break
+
+                database_bytes = self._database_bytes(con)
+                if database_bytes <= self.max_bytes or (previous_bytes is not None and database_bytes >= previous_bytes):
+                    # Either within the limit, or the dropped blocks are still referenced by a running query
+                    break
+
+                if not self._segments[0].sealed:
+                    if self._segments[0].rows == 0:
+                        break
+                    self._rotate(con)
+
+                self._discard_segment(con, self._segments[0], reason=f"the database is larger than {self.max_bytes} bytes")
+                previous_bytes = database_bytes
+
+    def _update_backlog(self, con: duckdb.DuckDBPyConnection, checkpoint: bool = False):
+        """
+        Updates the backlog accounting from the segment record counts, the flush times and the database
+        size, without scanning any segment.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            checkpoint (bool): Whether to checkpoint first, so the blocks of dropped records are released before measuring.
+        """
+        while self._ingested and self._ingested[0][0] <= self._ack_seq:
+            self._ingested.popleft()
+
+        self.backlog_rows = sum(self._pending_rows(segment) for segment in self._segments)
+        self.backlog_age = (datetime.now() - self._ingested[0][1]).total_seconds() if self._ingested else 0.0
+
+        if checkpoint:
+            try:
+                con.execute("CHECKPOINT")
+            except duckdb.Error:
+                pass
+
+        self.backlog_bytes = self._database_bytes(con)
+
+    def _pending_rows(self, segment: Segment) -> int:
+        """
+        Returns the approximate number of unacknowledged records of a segment.
+
+        Args:
+            segment (Segment): The segment.
+
+        Returns:
+            int: The number of records, estimated from the sequence range of a partially acknowledged segment.
+        """
+        last_seq = segment.last_seq if segment.sealed else self._max_seq
+        if last_seq <= self._ack_seq:
+            return 0
+        if segment.first_seq > self._ack_seq:
+            return segment.rows
+
+        return round(segment.rows * (last_seq - self._ack_seq) / (last_seq - segment.first_seq + 1))
+
+    def _backlog_level(self) -> float:
+        return {"rows": self.backlog_rows, "bytes": self.backlog_bytes, "age": self.backlog_age}[self.backlog_metric]
+
+    def _enforce_backlog(self, con: duckdb.DuckDBPyConnection):
+        """
+        Updates the backlog accounting and applies the backlog policy from when the backlog reaches the
+        high watermark until it is back under the low watermark.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+        """
+        with self._segments_lock:
+            self._update_backlog(con, checkpoint=self.backlog_exceeded and self.backlog_metric == "bytes")
+
+            if self.backlog_policy == "none" or not self.backlog_high_watermark:
+                return
+
+            if not self.backlog_exceeded and self._backlog_level() >= self.backlog_high_watermark:
+                self.backlog_exceeded = True
+                print(
+                    f"Backlog of {self.backlog_rows} records, {self.backlog_bytes} bytes and {self.backlog_age:.0f} seconds "
+                    f"reached the high watermark of {self.backlog_high_watermark} {BACKLOG_METRICS[self.backlog_metric]}, applying '{self.backlog_policy}' policy"
                 )
-                """
+
+            if self.backlog_exceeded and self.backlog_policy in ("drop_oldest", "downsample"):
+                self._reduce_backlog(con)
+
+            if self.backlog_exceeded and self._backlog_level() <= self.backlog_low_watermark:
+                self.backlog_exceeded = False
+                print(
+                    f"Backlog of {self.backlog_rows} records, {self.backlog_bytes} bytes and {self.backlog_age:.0f} seconds "
+                    f"is back under the low watermark of {self.backlog_low_watermark} {BACKLOG_METRICS[self.backlog_metric]}"
+                    f"{f' ({self.dropped_records} incoming records discarded so far)' if self.backlog_policy == 'stop_ingest' else ''}"
+                )
+
+    def _reduce_backlog(self, con: duckdb.DuckDBPyConnection):
+        """
+        Downsamples or drops the oldest segments until the backlog is under the low watermark.
+
+        Downsampling does not reduce the age of the backlog, so with the 'age' metric the 'downsample'
+        policy drops the oldest segments like 'drop_oldest'.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+        """
+        downsample = self.backlog_policy == "downsample" and self.backlog_metric != "age"
+
+        while self._backlog_level() > self.backlog_low_watermark:
+            level = self._backlog_level()
+
+            if downsample and self._segments[-1].rows > 0 and all(segment.downsampled for segment in self._segments[:-1]):
+                # Seal the active segment so its records are downsampled before any segment is dropped
+                self._rotate(con)
+
+            segment = next((segment for segment in self._segments if segment.sealed and not segment.downsampled), None) if downsample else None
+
+            if segment is not None:
+                self._downsample_segment(con, segment)
+            else:
+                if not self._segments[0].sealed:
+                    if self._segments[0].rows == 0:
+                        break
+                    self._rotate(con)
+
+                self._discard_segment(con, self._segments[0], reason=f"the backlog is above the high watermark of {self.backlog_high_watermark} {BACKLOG_METRICS[self.backlog_metric]}")
+
+            self._update_backlog(con, checkpoint=self.backlog_metric == "bytes")
+
+            if segment is None and self.backlog_metric == "bytes" and self._backlog_level() >= level:
+                # The blocks of the dropped segment are still referenced by a running query
+                break
+
+    def _downsample_segment(self, con: duckdb.DuckDBPyConnection, segment: Segment):
+        """
+        Keeps only the last unacknowledged record per asset, datastream and `downsample_interval` seconds of a sealed segment.
+
+        The segment table is rewritten rather than deleted from, so the blocks of the removed records are
+        released on the next checkpoint. Sealed segments receive no more inserts and need no primary key.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            segment (Segment): The sealed segment to downsample.
+        """
+        (rows,) = con.execute(
+            f"""
+            CREATE OR REPLACE TABLE {segment.table} AS
+            SELECT * FROM {segment.table}
+            WHERE seq IN (
+                SELECT arg_max(seq, timestamp)
+                FROM {segment.table}
+                WHERE seq > ?
+                GROUP BY time_bucket(to_microseconds({int(self.downsample_interval * 1_000_000)}), timestamp), asset, datastream
             )
+            """,
+            (self._ack_seq,),
+        ).fetchall()[0]
 
-        print(f"Successfully created timeseries database: '{self.db_path}'")
+        removed = max(segment.rows - rows, 0)
+        segment.rows = rows
+        segment.downsampled = True
+        con.execute("UPDATE timeseries_segments SET rows = ?, downsampled = true WHERE id = ?", (segment.rows, segment.id))
+
+        print(f"Downsampled timeseries segment '{segment.table}' to {self.downsample_interval} second intervals, removing {removed} records")
+
+    def _discard_segment(self, con: duckdb.DuckDBPyConnection, segment: Segment, reason: str):
+        """
+        Drops a sealed segment by retention, moving the acknowledged watermark past any of its records that were never exported.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            segment (Segment): The sealed segment to drop.
+            reason (str): Why the segment is dropped.
+        """
+        if segment.last_seq > self._ack_seq:
+            print(f"Discarding unacknowledged records of timeseries segment '{segment.table}' because {reason}")
+            self._set_ack_seq(con, segment.last_seq)
+
+        self._drop_segment(con, segment)
+
+    def _set_ack_seq(self, con: duckdb.DuckDBPyConnection, ack_seq: int):
+        """
+        Advances and persists the acknowledged watermark.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            ack_seq (int): The highest acknowledged sequence number.
+        """
+        self._ack_seq = max(self._ack_seq, ack_seq)
+        con.execute("UPDATE timeseries_watermark SET ack_seq = ?", (self._ack_seq,))
+
+        # Batches below the watermark are delivered or discarded, and leave the manifest
+        con.execute("DELETE FROM timeseries_batches WHERE last_seq <= ?", (self._ack_seq,))
+        self._batches = {first_seq: batch for first_seq, batch in self._batches.items() if batch[0] > self._ack_seq}
+
+    def _set_batch_state(self, con: duckdb.DuckDBPyConnection, batch_id: BatchId, state: str):
+        """
+        Records the delivery state of a batch in the manifest.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            batch_id (BatchId): The batch id.
+            state (str): The delivery state ('exported', 'uploaded' or 'acked').
+        """
+        with self._segments_lock:
+            con.execute(
+                "INSERT OR REPLACE INTO timeseries_batches (first_seq, last_seq, state, updated_at) VALUES (?, ?, ?, ?)",
+                (batch_id[0], batch_id[1], state, datetime.now()),
+            )
+            self._batches[batch_id[0]] = (batch_id[1], state)
+
+    def _database_bytes(self, con: duckdb.DuckDBPyConnection) -> int:
+        """
+        Returns the number of bytes used by the database, excluding free blocks, plus its write-ahead log.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+
+        Returns:
+            int: The used size of the database in bytes.
+        """
+        block_size, used_blocks = con.execute("SELECT block_size, used_blocks FROM pragma_database_size()").fetchall()[0]
+        wal_path = f"{self.db_path}.wal"
+        wal_bytes = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        return block_size * used_blocks + wal_bytes
 
     async def insert(self, timestamp: datetime, asset: str, datastream: str, payload: Union[float, str, bool]):
         """
-        Asynchronously inserts or updates a record in the `timeseries` table.
+        Asynchronously inserts or updates a record in the timeseries database.
+
+        The record is added to the in-memory buffer, which is flushed to the database
+        once it holds `flush_size` records.
 
         Args:
             timestamp (datetime): The timestamp of the data.
@@ -62,164 +903,827 @@ class TimeseriesDataStore:
             datastream (str): The datastream identifier.
             payload (Union[float, str, bool]): The payload data, which can be a number, string, or boolean.
         """
-        await asyncio.to_thread(self._insert, timestamp, asset, datastream, payload)
+        if self.backlog_exceeded and self.backlog_policy == "stop_ingest":
+            # Ingestion is stopped until the backlog is back under the low watermark
+            self.dropped_records += 1
+            return
+
+        self._buffer[(timestamp, asset, datastream)] = payload
 
-    def _insert(self, timestamp: datetime, asset: str, datastream: str, payload: Union[float, str, bool]):
+        if len(self._buffer) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Asynchronously writes all buffered records to the timeseries database.
         """
-        Synchronously inserts or updates a record in the `timeseries` table.
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+
+            buffer = self._buffer
+            rows = [(timestamp, asset, datastream, payload) for (timestamp, asset, datastream), payload in buffer.items()]
+            self._buffer = {}
+
+            # Records inserted from now on are written by the next flush
+            generation = self.buffer_generation
+            self.buffer_generation += 1
+
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._insert, rows)
+            except BaseException:
+                # Put the records back for the next flush, keeping the newer writes of the same keys
+                buffer.update(self._buffer)
+                self._buffer = buffer
+                raise
+
+            self.flush_count += 1
+            self.flushed_generation = generation + 1
+            self.last_flush_time = time.perf_counter()
+            self.last_flush_rows = len(rows)
+            self.last_flush_latency = self.last_flush_time - start
+
+            print(f"Flushed {self.last_flush_rows} records to timeseries database in {self.last_flush_latency * 1000:.1f} ms")
+
+    async def _flush_periodically(self):
+        """
+        Flushes the buffer every `flush_interval` seconds so records never wait on a full buffer.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error occurred during flush: {e}")
+
+    def _insert(self, rows: List[Tuple[datetime, str, str, Union[float, str, bool]]]):
+        """
+        Synchronously inserts or updates records in the active segment with a single statement, rotating
+        the active segment first when it is full or too old.
+
+        If the batch is rejected (e.g. a payload that does not match the column type), its records are
+        retried one by one so a single invalid record does not discard the whole batch. Other errors,
+        like a failed write, are raised so the records are kept for the next flush.
 
         Args:
-            timestamp (datetime): The timestamp of the data.
-            asset (str): The asset identifier.
-            datastream (str): The datastream identifier.
-            payload (Union[float, str, bool]): The payload data, which can be a number, string, or boolean.
+            rows (List[Tuple[datetime, str, str, Union[float, str, bool]]]): The (timestamp, asset, datastream, payload) records.
+        """
+        con = self._cursor()
+        flushed_at = datetime.now()
+
+        # The active segment is held until the insert is accounted for, so an acknowledgement or the backlog
+        # policy cannot rotate, downsample or drop it in between
+        with self._segments_lock:
+            segment = self._segments[-1]
+            if segment.rows >= self.segment_size or (segment.rows > 0 and datetime.now() - segment.created_at >= timedelta(seconds=self.segment_interval)):
+                self._rotate(con)
+                segment = self._segments[-1]
+
+            try:
+                self._insert_rows(con, segment, rows)
+            except duckdb.Error as e:
+                print(f"Error occurred inserting {len(rows)} records, retrying individually: {e}")
+
+                for row in rows:
+                    try:
+                        self._insert_rows(con, segment, [row])
+                    except RECORD_ERRORS as e:
+                        print(f"Skipping invalid record {row}: {e}")
+
+            segment.rows += len(rows)
+
+            # Advance the committed watermark and the segment timestamp bounds, only scanning the records added by this insert
+            max_seq, min_timestamp, max_timestamp = con.execute(
+                f"SELECT max(seq), min(timestamp), max(timestamp) FROM {segment.table} WHERE seq > ?", (self._max_seq,)
+            ).fetchall()[0]
+            if max_seq is not None:
+                self._max_seq = max_seq
+                self._ingested.append((max_seq, flushed_at))
+                segment.min_timestamp = min(segment.min_timestamp or min_timestamp, min_timestamp)
+                segment.max_timestamp = max(segment.max_timestamp or max_timestamp, max_timestamp)
+
+            self._enforce_retention(con)
+            self._enforce_backlog(con)
+
+    @staticmethod
+    def _insert_rows(con: duckdb.DuckDBPyConnection, segment: Segment, rows: List[Tuple[datetime, str, str, Union[float, str, bool]]]):
+        """
+        Inserts or updates records in a segment table, binding each column as a single list parameter.
+        Records are appended as-is to append-only segments.
+
+        Each payload is written to the column of its type. Batches of numeric payloads only bind the
+        `payload` column and leave the type tag at its 'number' default.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            segment (Segment): The segment to write to.
+            rows (List[Tuple[datetime, str, str, Union[float, str, bool]]]): The (timestamp, asset, datastream, payload) records.
+        """
+        timestamps, assets, datastreams, payloads = (list(column) for column in zip(*rows))
+        columns = ["timestamp", "asset", "datastream", "payload"]
+        parameters = [timestamps, assets, datastreams, payloads]
+
+        # A missing payload is stored as a NULL number, like the numeric payload column of previous versions
+        if not all(payload is None or (isinstance(payload, (int, float)) and not isinstance(payload, bool)) for payload in payloads):
+            types = [
+                "boolean" if isinstance(payload, bool) else "number" if payload is None or isinstance(payload, (int, float)) else "string" for payload in payloads
+            ]
+            columns += TYPED_PAYLOAD_COLUMNS
+            parameters = [
+                timestamps,
+                assets,
+                datastreams,
+                [payload if type == "number" else None for payload, type in zip(payloads, types)],
+                types,
+                [str(payload) if type == "string" else None for payload, type in zip(payloads, types)],
+                [payload if type == "boolean" else None for payload, type in zip(payloads, types)],
+            ]
+
+        updates = ", ".join(f"{column} = excluded.{column}" for column in ["payload", *TYPED_PAYLOAD_COLUMNS, "seq"])
+
+        con.execute(
+            f"""
+            INSERT INTO {segment.table} ({', '.join(columns)}) 
+            SELECT {', '.join('UNNEST(?)' for _ in columns)}
+            {'' if segment.append_only else f'ON CONFLICT (timestamp, asset, datastream) DO UPDATE SET {updates}'}
+            """,
+            parameters,
+        )
+
+    def _find_batch(self, limit: Optional[int] = None, after: Optional[int] = None) -> Optional[Tuple[Segment, BatchId, int, bool]]:
+        """
+        Finds the next batch to export: the sequence range starting right after `after` (or after the
+        acknowledged watermark) and spanning at most `limit` sequence numbers. A batch recorded in the
+        manifest is found again with its recorded range, whatever the limit, so it keeps its name.
+
+        The range is found with range filters on the sequence column instead of sorting the whole
+        backlog. A batch never spans more than one segment, and covers a whole sealed segment when
+        `limit` allows it.
+
+        Args:
+            limit (Optional[int]): The maximum number of records in the batch. If None, the batch spans the rest of the segment.
+            after (Optional[int]): Find records with a sequence number higher than this. Defaults to the acknowledged watermark.
+
+        Returns:
+            Optional[Tuple[Segment, BatchId, int, bool]]: The segment, batch id, number of records of the batch and whether it
+            holds non-numeric payloads, or None if there is no data.
+        """
+        con = self._cursor()
+        max_seq = self._max_seq
+        first_seq = (self._ack_seq if after is None else after) + 1
+
+        with self._segments_lock:
+            segments = list(self._segments)
+
+        for segment in segments:
+            segment_last_seq = segment.last_seq if segment.sealed else max_seq
+            if segment_last_seq < first_seq:
+                continue
+
+            first_seq = max(first_seq, segment.first_seq)
+
+            while first_seq is not None and first_seq <= segment_last_seq:
+                last_seq = segment_last_seq if limit is None else min(first_seq + limit - 1, segment_last_seq)
+                if first_seq in self._batches:
+                    last_seq = self._batches[first_seq][0]
+
+                count, typed = con.execute(
+                    f"SELECT count(*), count(*) FILTER (payload_type <> 'number') > 0 FROM ({self._batch_query(segment, (first_seq, last_seq), typed=True)})"
+                ).fetchall()[0]
+                if count > 0:
+                    return segment, (first_seq, last_seq), count, typed
+
+                # The range only held gaps left by updated or rejected records, skip to the next record
+                (first_seq,) = con.execute(f"SELECT min(seq) FROM {segment.table} WHERE seq > ?", (last_seq,)).fetchall()[0]
+
+            first_seq = segment_last_seq + 1
+
+        return None
+
+    @staticmethod
+    def _batch_query(segment: Segment, batch_id: BatchId, typed: bool = False) -> str:
+        """
+        Returns the query selecting the records of a batch in ingest order.
+
+        Args:
+            segment (Segment): The segment holding the batch.
+            batch_id (BatchId): The batch id.
+            typed (bool): Whether to select the typed payload columns along with the numeric `payload` column.
+
+        Returns:
+            str: The SQL query.
+        """
+        first_seq, last_seq = batch_id
+
+        return f"""
+            SELECT timestamp, asset, datastream, payload{''.join(f', {column}' for column in TYPED_PAYLOAD_COLUMNS) if typed else ''}
+            FROM {segment.table}
+            WHERE seq BETWEEN {first_seq} AND {last_seq}
+            {DEDUPLICATE if segment.append_only else ''}
+            ORDER BY seq ASC
+        """
+
+    def _rollup_query(self, query: str) -> str:
+        """
+        Returns the query aggregating the records selected by a query into rollups per asset, datastream and interval.
+
+        Args:
+            query (str): The SQL query selecting the records.
+
+        Returns:
+            str: The SQL query.
+        """
+        aggregates = "".join(f", {ROLLUP_AGGREGATES[name]} AS payload_{name}" for name in self.rollup_aggregates)
+
+        return f"""
+            SELECT time_bucket(to_microseconds({int(self.rollup_interval * 1_000_000)}), timestamp) AS timestamp, asset, datastream{aggregates}
+            FROM ({query})
+            GROUP BY ALL
+            ORDER BY timestamp, asset, datastream
         """
-        with duckdb.connect(self.db_path) as con:
-            con.execute(
-                """
-                INSERT INTO timeseries (timestamp, asset, datastream, payload) 
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT (timestamp, asset, datastream)
-                DO UPDATE SET payload = excluded.payload
-                """,
-                (timestamp, asset, datastream, payload),
-            )
 
     def _export_data(
-        self, file_path: Optional[str] = None, limit: Optional[int] = None, format: Optional[str] = None
-    ) -> Optional[Union[Tuple[str, int], Tuple[pd.DataFrame, int], Tuple[Dict[str, Union[str, float, bool]], int]]]:
+        self,
+        file_path: Optional[str] = None,
+        limit: Optional[int] = None,
+        format: Optional[str] = None,
+        after: Optional[int] = None,
+        compression: str = "zstd",
+        compression_level: Optional[int] = None,
+        row_group_size: Optional[int] = None,
+        file_size: Optional[int] = None,
+        partition_by: Optional[str] = None,
+        memory_limit: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        rollup: bool = False,
+    ) -> Union[
+        Tuple[str, int, BatchId],
+        Tuple[List[str], int, BatchId],
+        Tuple[IO[bytes], int, BatchId],
+        Tuple[pa.Table, int, BatchId],
+        Tuple["pd.DataFrame", int, BatchId],
+        Tuple[List[Dict[str, Union[datetime, str, float, bool]]], int, BatchId],
+        Tuple[None, int, None],
+    ]:
         """
-        Exports data from the `timeseries` table based on the specified format and limit.
+        Exports the next batch of data from the timeseries segments based on the specified format and limit.
+
+        Parquet and CSV files are written by DuckDB straight from the query, without materializing
+        the batch in Python memory.
 
         Args:
             file_path (Optional[str]): The file path to save the exported data, if applicable.
             limit (Optional[int]): The maximum number of records to export. If None, all available records will be exported.
-            format (Optional[str]): The format to export the data in ('parquet', 'csv', 'df' for DataFrame, or None for dictionary).
+            format (Optional[str]): The format to export the data in ('parquet', 'parquet_buffer' for an in-memory Parquet file, 'csv',
+                'arrow' for an Arrow table, 'df' for DataFrame, or None for dictionary).
+            after (Optional[int]): Export records with a sequence number higher than this. Defaults to the acknowledged watermark.
+            compression (str): The Parquet compression codec ('zstd', 'snappy', 'gzip' or 'none'). Defaults to 'zstd'.
+            compression_level (Optional[int]): The Parquet compression level, only used by 'zstd'. Defaults to DuckDB's level.
+            row_group_size (Optional[int]): The number of records per Parquet row group. Defaults to DuckDB's row group size.
+            file_size (Optional[int]): The target Parquet file size in bytes, which caps `limit` based on the size of previous exports.
+            partition_by (Optional[str]): Splits the Parquet export by asset and 'day' or 'hour' into a Hive-partitioned directory at `file_path`.
+            memory_limit (Optional[int]): The size in bytes above which a Parquet buffer spills to a temporary file. If None, it is kept in memory.
+            spill_dir (Optional[str]): The directory of the temporary file a Parquet buffer spills to. Defaults to the system temporary directory.
+            rollup (bool): Whether to export the rollups of the batch instead of its records.
 
         Returns:
-            Optional[Union[Tuple[str, int], Tuple[pd.DataFrame, int], Tuple[Dict[str, Union[str, float, bool]], int]]]:
-            A tuple containing the exported data in the specified format and the number of records exported:
-            - For 'parquet' or 'csv', the first element is the file path, and the second element is the number of records.
-            - For 'df', the first element is a Pandas DataFrame, and the second element is the number of records.
-            - For None (default dictionary export), the first element is a dictionary and the second element is the number of records.
+            Union[Tuple[str, int, BatchId], Tuple[List[str], int, BatchId], Tuple[IO[bytes], int, BatchId], Tuple[pa.Table, int, BatchId], Tuple[pd.DataFrame, int, BatchId], Tuple[List[Dict[str, Union[datetime, str, float, bool]]], int, BatchId], Tuple[None, int, None]]:
+            A tuple containing the exported data in the specified format, the number of records in the batch and the batch id:
+            - For 'parquet' or 'csv', the first element is the file path.
+            - For partitioned 'parquet', the first element is the list of written file paths.
+            - For 'parquet_buffer', the first element is a file object positioned at the start of the Parquet data.
+            - For 'arrow', the first element is an Arrow table with dictionary-encoded asset and datastream columns.
+            - For 'df', the first element is a Pandas DataFrame with categorical asset and datastream columns.
+            - For None (default dictionary export), the first element is a list of dictionaries.
+            - If there is no data to export, the tuple is (None, 0, None).
         """
-        print(f"Exporting database values into {format} {'file' if file_path else ''}")
+        print(f"Exporting database {'rollups' if rollup else 'values'} into {format} {'file' if file_path else ''}")
 
-        query = f"""
-            SELECT timestamp, asset, datastream, payload
-            FROM timeseries
-            ORDER BY timestamp ASC
-            {'LIMIT ' + str(limit) if limit is not None else ''}
-        """
+        if format in ("parquet", "parquet_buffer") and file_size and self._parquet_bytes_per_row and not rollup:
+            # The batch ends before the records it leaves out, so `has_more` still reports them
+            file_size_limit = max(1, int(file_size / self._parquet_bytes_per_row))
+            limit = file_size_limit if limit is None else min(limit, file_size_limit)
 
-        with duckdb.connect(self.db_path) as con:
-            result = con.query(query)
+        batch = self._find_batch(limit=limit, after=after)
+        if batch is None:
+            print("Skipping database export because query returned 0 values")
+            return None, 0, None
 
-            if len(result) == 0:
-                print("Skipping database export because query returned 0 values")
-                return None, 0
+        segment, batch_id, count, typed = batch
+        query = self._rollup_query(self._batch_query(segment, batch_id)) if rollup else self._batch_query(segment, batch_id, typed)
+        con = self._cursor()
 
-            print(f"Successfully exported {len(result)} database values to {format} {'file: ' + file_path if file_path else ''}")
+        if format == "parquet":
+            options = [f"FORMAT PARQUET, COMPRESSION {'uncompressed' if compression == 'none' else compression}"]
+            if compression_level is not None and compression == "zstd":
+                options.append(f"COMPRESSION_LEVEL {int(compression_level)}")
+            if row_group_size:
+                options.append(f"ROW_GROUP_SIZE {int(row_group_size)}")
 
-            if format == "parquet":
-                result.to_parquet(file_path)
-                return file_path, len(result)
-            elif format == "csv":
-                result.to_csv(file_path)
-                return file_path, len(result)
-            elif format == "df":
-                df = result.to_df()
-                return df, len(result)
+            if partition_by:
+                # Files are named after the batch, e.g. asset=<a>/date=<d>/part-<store id>-<first seq>-<last seq>-0.parquet
+                columns = PARTITIONS[partition_by]
+                query = f"SELECT *, {', '.join(f'{expression} AS {column}' for column, expression in columns.items())} FROM ({query})"
+                options.append(f"PARTITION_BY (asset, {', '.join(columns)})")
+                options.append(f"FILENAME_PATTERN '{self.batch_name(batch_id)}-{{i}}', OVERWRITE, RETURN_FILES")
+
+                (_, data) = con.execute(f"COPY ({query}) TO '{self._quote(file_path)}' ({', '.join(options)})").fetchall()[0]
+                file_bytes = sum(os.path.getsize(path) for path in data)
             else:
-                data = [{"timestamp": row[0], "asset": row[1], "datastream": row[2], "payload": row[3]} for row in result]
-                return data, len(result)
+                con.execute(f"COPY ({query}) TO '{self._quote(file_path)}' ({', '.join(options)})")
+                file_bytes = os.path.getsize(file_path)
+                data = file_path
+        elif format == "parquet_buffer":
+            data = self._write_parquet_buffer(con, query, compression, compression_level, row_group_size, memory_limit, spill_dir)
+            file_bytes = data.seek(0, os.SEEK_END)
+            data.seek(0)
+        elif format == "csv":
+            con.execute(f"COPY ({query}) TO '{self._quote(file_path)}' (FORMAT CSV, HEADER)")
+            data = file_path
+        elif format == "arrow":
+            data = self._to_arrow(con, query)
+        elif format == "df":
+            data = self._to_arrow(con, query).to_pandas()
+        elif rollup:
+            result = con.execute(query)
+            names = [column[0] for column in result.description]
+            data = [dict(zip(names, row)) for row in result.fetchall()]
+        else:
+            rows = con.execute(query).fetchall()
+            if typed:
+                # Take each payload from the column of its type, with the typed columns selected after `payload`
+                columns = {"number": 3, "string": 5, "boolean": 6}
+                rows = [(*row[:3], row[columns[row[4]]]) for row in rows]
+
+            data = [{"timestamp": row[0], "asset": row[1], "datastream": row[2], "payload": row[3]} for row in rows]
+
+        if format in ("parquet", "parquet_buffer") and not rollup:
+            self._parquet_bytes_per_row = file_bytes / count
+
+        if batch_id[0] not in self._batches:
+            self._set_batch_state(con, batch_id, "exported")
+
+        print(f"Successfully exported {'rollups of ' if rollup else ''}{count} database values (batch {batch_id}) to {format} {'file: ' + file_path if file_path else ''}")
+
+        return data, count, batch_id
+
+    @staticmethod
+    def _write_parquet_buffer(
+        con: duckdb.DuckDBPyConnection,
+        query: str,
+        compression: str,
+        compression_level: Optional[int],
+        row_group_size: Optional[int],
+        memory_limit: Optional[int],
+        spill_dir: Optional[str],
+    ) -> IO[bytes]:
+        """
+        Writes the result of a query as Parquet into a buffer that is kept in memory up to `memory_limit`
+        bytes and spills to a temporary file above it. Records are streamed as Arrow record batches.
 
-    async def export_parquet(self, file_path: str, limit: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            query (str): The SQL query.
+            compression (str): The compression codec ('zstd', 'snappy', 'gzip' or 'none').
+            compression_level (Optional[int]): The compression level, only used by 'zstd'.
+            row_group_size (Optional[int]): The number of records per row group.
+            memory_limit (Optional[int]): The size in bytes above which the buffer spills to a temporary file. If None, it is kept in memory.
+            spill_dir (Optional[str]): The directory of the temporary file. Defaults to the system temporary directory.
+
+        Returns:
+            IO[bytes]: The buffer, which is deleted from disk when closed.
+        """
+        row_group_size = int(row_group_size) if row_group_size else 122_880
+        reader = con.execute(query).to_arrow_reader(row_group_size)
+        buffer = tempfile.SpooledTemporaryFile(max_size=memory_limit or 0, dir=spill_dir)
+
+        writer = pq.ParquetWriter(
+            buffer,
+            reader.schema,
+            compression=compression,
+            compression_level=compression_level if compression == "zstd" else None,
+        )
+        try:
+            for batch in reader:
+                writer.write_batch(batch, row_group_size=row_group_size)
+        finally:
+            writer.close()
+
+        return buffer
+
+    @staticmethod
+    def _to_arrow(con: duckdb.DuckDBPyConnection, query: str) -> pa.Table:
+        """
+        Fetches the result of a query as an Arrow table, dictionary-encoding the asset and datastream
+        columns so their few distinct values are stored once.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): The database connection.
+            query (str): The SQL query.
+
+        Returns:
+            pa.Table: The Arrow table.
+        """
+        table = con.execute(query).to_arrow_table().combine_chunks()
+
+        for name in ("asset", "datastream"):
+            table = table.set_column(table.schema.get_field_index(name), name, table[name].dictionary_encode())
+
+        return table
+
+    @staticmethod
+    def _quote(value: str) -> str:
         """
-        Asynchronously exports data to a Parquet file.
+        Escapes a value to be used inside a single-quoted SQL string literal.
+
+        Args:
+            value (str): The value to escape.
+
+        Returns:
+            str: The escaped value.
+        """
+        return value.replace("'", "''")
+
+    async def export_parquet(
+        self,
+        file_path: str,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+        compression: str = "zstd",
+        compression_level: Optional[int] = None,
+        row_group_size: Optional[int] = None,
+        file_size: Optional[int] = None,
+        rollup: bool = False,
+    ) -> Union[Tuple[str, int, BatchId], Tuple[None, int, None]]:
+        """
+        Asynchronously exports the next batch of data to a Parquet file.
 
         Args:
             file_path (str): The file path to save the Parquet file.
             limit (Optional[int]): The maximum number of records to export. If None, all available records will be exported.
+            after (Optional[int]): Export records with a sequence number higher than this. Defaults to the acknowledged watermark.
+            rollup (bool): Whether to export the rollups of the batch instead of its records. Defaults to False.
+            compression (str): The compression codec ('zstd', 'snappy', 'gzip' or 'none'). Defaults to 'zstd'.
+            compression_level (Optional[int]): The compression level, only used by 'zstd'. Defaults to DuckDB's level.
+            row_group_size (Optional[int]): The number of records per row group. Defaults to DuckDB's row group size.
+            file_size (Optional[int]): The target file size in bytes, which caps `limit` based on the size of previous exports.
 
         Returns:
-            Optional[Tuple[str, int]]: A tuple containing the file path to the saved Parquet file and the number of records exported.
+            Union[Tuple[str, int, BatchId], Tuple[None, int, None]]: A tuple containing the file path to the saved Parquet file,
+            the number of records exported and the batch id.
         """
-        return await asyncio.to_thread(self._export_data, file_path, limit, format="parquet")
+        await self.flush()
+        return await asyncio.to_thread(
+            self._export_data,
+            file_path,
+            limit,
+            format="parquet",
+            after=after,
+            rollup=rollup,
+            compression=compression,
+            compression_level=compression_level,
+            row_group_size=row_group_size,
+            file_size=file_size,
+        )
 
-    async def export_csv(self, file_path: str, limit: Optional[int] = None) -> Optional[Tuple[str, int]]:
+    async def export_parquet_partitioned(
+        self,
+        dir_path: str,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+        partition_by: str = "day",
+        compression: str = "zstd",
+        compression_level: Optional[int] = None,
+        row_group_size: Optional[int] = None,
+        file_size: Optional[int] = None,
+        rollup: bool = False,
+    ) -> Union[Tuple[List[str], int, BatchId], Tuple[None, int, None]]:
         """
-        Asynchronously exports data to a CSV file.
+        Asynchronously exports the next batch of data to Parquet files, split by asset and by day or hour
+        into a Hive-partitioned directory (`asset=<a>/date=<d>[/hour=<h>]/part-<seq>-<i>.parquet`).
+
+        Args:
+            dir_path (str): The directory to save the Parquet files, which is overwritten.
+            limit (Optional[int]): The maximum number of records to export. If None, all available records will be exported.
+            after (Optional[int]): Export records with a sequence number higher than this. Defaults to the acknowledged watermark.
+            rollup (bool): Whether to export the rollups of the batch instead of its records. Defaults to False.
+            partition_by (str): The time partition granularity ('day' or 'hour'). Defaults to 'day'.
+            compression (str): The compression codec ('zstd', 'snappy', 'gzip' or 'none'). Defaults to 'zstd'.
+            compression_level (Optional[int]): The compression level, only used by 'zstd'. Defaults to DuckDB's level.
+            row_group_size (Optional[int]): The number of records per row group. Defaults to DuckDB's row group size.
+            file_size (Optional[int]): The target total size in bytes, which caps `limit` based on the size of previous exports.
+
+        Returns:
+            Union[Tuple[List[str], int, BatchId], Tuple[None, int, None]]: A tuple containing the paths of the saved Parquet files,
+            the number of records exported and the batch id.
+        """
+        if partition_by not in PARTITIONS:
+            raise ValueError(f"Invalid partition granularity '{partition_by}', expected one of {list(PARTITIONS)}")
+
+        await self.flush()
+        return await asyncio.to_thread(
+            self._export_data,
+            dir_path,
+            limit,
+            format="parquet",
+            after=after,
+            rollup=rollup,
+            compression=compression,
+            compression_level=compression_level,
+            row_group_size=row_group_size,
+            file_size=file_size,
+            partition_by=partition_by,
+        )
+
+    async def export_parquet_buffer(
+        self,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+        compression: str = "zstd",
+        compression_level: Optional[int] = None,
+        row_group_size: Optional[int] = None,
+        file_size: Optional[int] = None,
+        memory_limit: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        rollup: bool = False,
+    ) -> Union[Tuple[IO[bytes], int, BatchId], Tuple[None, int, None]]:
+        """
+        Asynchronously exports the next batch of data to an in-memory Parquet file, which spills to a
+        temporary file only when it grows over `memory_limit` bytes.
+
+        Args:
+            limit (Optional[int]): The maximum number of records to export. If None, all available records will be exported.
+            after (Optional[int]): Export records with a sequence number higher than this. Defaults to the acknowledged watermark.
+            rollup (bool): Whether to export the rollups of the batch instead of its records. Defaults to False.
+            compression (str): The compression codec ('zstd', 'snappy', 'gzip' or 'none'). Defaults to 'zstd'.
+            compression_level (Optional[int]): The compression level, only used by 'zstd'. Defaults to pyarrow's level.
+            row_group_size (Optional[int]): The number of records per row group. Defaults to DuckDB's row group size.
+            file_size (Optional[int]): The target file size in bytes, which caps `limit` based on the size of previous exports.
+            memory_limit (Optional[int]): The size in bytes above which the buffer spills to a temporary file. If None, it is kept in memory.
+            spill_dir (Optional[str]): The directory of the temporary file. Defaults to the system temporary directory.
+
+        Returns:
+            Union[Tuple[IO[bytes], int, BatchId], Tuple[None, int, None]]: A tuple containing the Parquet buffer, positioned at
+            its start and to be closed by the caller, the number of records exported and the batch id.
+        """
+        await self.flush()
+        return await asyncio.to_thread(
+            self._export_data,
+            None,
+            limit,
+            format="parquet_buffer",
+            after=after,
+            rollup=rollup,
+            compression=compression,
+            compression_level=compression_level,
+            row_group_size=row_group_size,
+            file_size=file_size,
+            memory_limit=memory_limit,
+            spill_dir=spill_dir,
+        )
+
+    async def export_csv(
+        self, file_path: str, limit: Optional[int] = None, after: Optional[int] = None, rollup: bool = False
+    ) -> Union[Tuple[str, int, BatchId], Tuple[None, int, None]]:
+        """
+        Asynchronously exports the next batch of data to a CSV file.
 
         Args:
             file_path (str): The file path to save the CSV file.
             limit (Optional[int]): The maximum number of records to export. If None, all available records will be exported.
+            after (Optional[int]): Export records with a sequence number higher than this. Defaults to the acknowledged watermark.
+            rollup (bool): Whether to export the rollups of the batch instead of its records. Defaults to False.
 
         Returns:
-            Optional[Tuple[str, int]]: A tuple containing the file path to the saved CSV file and the number of records exported.
+            Union[Tuple[str, int, BatchId], Tuple[None, int, None]]: A tuple containing the file path to the saved CSV file,
+            the number of records exported and the batch id.
         """
-        return await asyncio.to_thread(self._export_data, file_path, limit, format="csv")
+        await self.flush()
+        return await asyncio.to_thread(self._export_data, file_path, limit, format="csv", after=after, rollup=rollup)
 
-    async def export_df(self, limit: Optional[int] = None) -> Optional[Tuple[pd.DataFrame, int]]:
+    async def export_arrow(
+        self, limit: Optional[int] = None, after: Optional[int] = None, rollup: bool = False
+    ) -> Union[Tuple[pa.Table, int, BatchId], Tuple[None, int, None]]:
         """
-        Asynchronously exports data to a Pandas DataFrame.
+        Asynchronously exports the next batch of data to an Arrow table, with dictionary-encoded asset and datastream columns.
 
         Args:
             limit (Optional[int]): The maximum number of records to export. If None, all available records will be exported.
+            after (Optional[int]): Export records with a sequence number higher than this. Defaults to the acknowledged watermark.
+            rollup (bool): Whether to export the rollups of the batch instead of its records. Defaults to False.
 
         Returns:
-            Optional[Tuple[pd.DataFrame, int]]: A tuple containing a Pandas DataFrame with the exported data and the number of records exported.
+            Union[Tuple[pa.Table, int, BatchId], Tuple[None, int, None]]: A tuple containing an Arrow table with the exported data,
+            the number of records exported and the batch id.
         """
-        return await asyncio.to_thread(self._export_data, format="df", limit=limit)
+        await self.flush()
+        return await asyncio.to_thread(self._export_data, format="arrow", limit=limit, after=after, rollup=rollup)
 
-    async def export_dict(self, limit: Optional[int] = None) -> Optional[Tuple[Dict[str, Union[str, float, bool]], int]]:
+    async def export_df(
+        self, limit: Optional[int] = None, after: Optional[int] = None, rollup: bool = False
+    ) -> Union[Tuple["pd.DataFrame", int, BatchId], Tuple[None, int, None]]:
         """
-        Asynchronously exports data to a dictionary.
+        Asynchronously exports the next batch of data to a Pandas DataFrame, with categorical asset and datastream columns.
 
         Args:
             limit (Optional[int]): The maximum number of records to export. If None, all available records will be exported.
+            after (Optional[int]): Export records with a sequence number higher than this. Defaults to the acknowledged watermark.
+            rollup (bool): Whether to export the rollups of the batch instead of its records. Defaults to False.
 
         Returns:
-            Optional[Tuple[Dict[str, Union[str, float, bool]], int]]: A tuple containing a dictionary with the exported data and the number of records exported.
+            Union[Tuple[pd.DataFrame, int, BatchId], Tuple[None, int, None]]: A tuple containing a Pandas DataFrame with the exported data,
+            the number of records exported and the batch id.
         """
-        return await asyncio.to_thread(self._export_data, limit=limit)
+        await self.flush()
+        return await asyncio.to_thread(self._export_data, format="df", limit=limit, after=after, rollup=rollup)
 
-    async def trim(self, limit: Optional[int] = None):
+    async def export_dict(
+        self, limit: Optional[int] = None, after: Optional[int] = None, rollup: bool = False
+    ) -> Union[Tuple[List[Dict[str, Union[datetime, str, float, bool]]], int, BatchId], Tuple[None, int, None]]:
         """
-        Asynchronously trims the oldest records from the `timeseries` table.
+        Asynchronously exports the next batch of data to a list of dictionaries.
 
         Args:
-            limit (Optional[int]): The number of oldest records to delete. If None, all records are deleted.
+            limit (Optional[int]): The maximum number of records to export. If None, all available records will be exported.
+            after (Optional[int]): Export records with a sequence number higher than this. Defaults to the acknowledged watermark.
+            rollup (bool): Whether to export the rollups of the batch instead of its records. Defaults to False.
+
+        Returns:
+            Union[Tuple[List[Dict[str, Union[datetime, str, float, bool]]], int, BatchId], Tuple[None, int, None]]: A tuple containing
+            a list of dictionaries with the exported data, the number of records exported and the batch id.
         """
-        await asyncio.to_thread(self._trim, limit)
+        await self.flush()
+        return await asyncio.to_thread(self._export_data, limit=limit, after=after, rollup=rollup)
 
-    def _trim(self, limit: Optional[int]):
+    async def query(
+        self,
+        asset: str,
+        datastream: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: Optional[int] = 10000,
+    ) -> List[Dict[str, Union[datetime, str, float, bool]]]:
         """
-        Synchronously trims the oldest records from the `timeseries` table.
+        Asynchronously reads the records of an asset in a time window, without exporting nor acknowledging them.
+        Records still in the in-memory buffer are not included.
 
         Args:
-            limit (Optional[int]): The number of oldest records to delete. If None, all records are deleted.
+            asset (str): The asset identifier.
+            datastream (Optional[str]): The datastream identifier. Defaults to all datastreams of the asset.
+            start (Optional[datetime]): The inclusive start of the time window. Defaults to unbounded.
+            end (Optional[datetime]): The exclusive end of the time window. Defaults to unbounded.
+            limit (Optional[int]): The maximum number of records, keeping the most recent ones. Defaults to 10000, None for no limit.
+
+        Returns:
+            List[Dict[str, Union[datetime, str, float, bool]]]: The records in timestamp order.
         """
-        print("Trimming database values")
+        return await asyncio.get_running_loop().run_in_executor(self._query_executor, self._query, asset, datastream, start, end, limit)
 
-        if limit is None:
-            query = "DELETE FROM timeseries;"
-        else:
-            query = f"""
-            WITH rows_to_delete AS (
-                SELECT timestamp, asset, datastream
-                FROM timeseries
-                ORDER BY timestamp ASC
-                LIMIT {limit}
+    def _query(
+        self, asset: str, datastream: Optional[str], start: Optional[datetime], end: Optional[datetime], limit: Optional[int]
+    ) -> List[Dict[str, Union[datetime, str, float, bool]]]:
+        """
+        Synchronously reads the records of an asset in a time window from the segments overlapping it.
+
+        Args:
+            asset (str): The asset identifier.
+            datastream (Optional[str]): The datastream identifier, None for all datastreams of the asset.
+            start (Optional[datetime]): The inclusive start of the time window, None if unbounded.
+            end (Optional[datetime]): The exclusive end of the time window, None if unbounded.
+            limit (Optional[int]): The maximum number of records, keeping the most recent ones. None for no limit.
+
+        Returns:
+            List[Dict[str, Union[datetime, str, float, bool]]]: The records in timestamp order.
+        """
+        # Timestamps are stored as naive UTC
+        start, end = (value.astimezone(timezone.utc).replace(tzinfo=None) if value is not None and value.tzinfo else value for value in (start, end))
+
+        conditions = ["asset = $asset"]
+        parameters: Dict[str, Union[datetime, str, int]] = {"asset": asset}
+        for condition, name, value in [("datastream = $datastream", "datastream", datastream), ("timestamp >= $start", "start", start), ("timestamp < $end", "end", end)]:
+            if value is not None:
+                conditions.append(condition)
+                parameters[name] = value
+
+        con = self._cursor()
+
+        # A segment may be dropped by an acknowledgement while being read, then read the remaining segments again
+        for attempt in range(3):
+            with self._segments_lock:
+                segments = [segment for segment in self._segments if segment.overlaps(start, end)]
+
+            if not segments:
+                return []
+
+            selects = " UNION ALL ".join(
+                f"SELECT timestamp, asset, datastream, payload, {', '.join(TYPED_PAYLOAD_COLUMNS)}, seq FROM {segment.table} WHERE {' AND '.join(conditions)}"
+                for segment in segments
             )
-            DELETE FROM timeseries
-            USING rows_to_delete
-            WHERE timeseries.timestamp = rows_to_delete.timestamp
-                  AND timeseries.asset = rows_to_delete.asset
-                  AND timeseries.datastream = rows_to_delete.datastream;
-            """
 
-        with duckdb.connect(self.db_path) as con:
-            con.execute(query)
+            try:
+                rows = con.execute(
+                    f"""
+                    SELECT * EXCLUDE (seq) FROM (
+                        SELECT * FROM ({selects})
+                        {DEDUPLICATE}
+                        ORDER BY timestamp DESC
+                        {'LIMIT $limit' if limit is not None else ''}
+                    )
+                    ORDER BY timestamp, asset, datastream
+                    """,
+                    {**parameters, "limit": limit} if limit is not None else parameters,
+                ).fetchall()
+                break
+            except duckdb.CatalogException:
+                if attempt == 2:
+                    raise
+
+        # Take each payload from the column of its type, with the typed columns selected after `payload`
+        columns = {"number": 3, "string": 5, "boolean": 6}
+        return [{"timestamp": row[0], "asset": row[1], "datastream": row[2], "payload": row[columns[row[4]]]} for row in rows]
+
+    def batch_name(self, batch_id: BatchId) -> str:
+        """
+        Returns the name of a batch, derived from its sequence range so that a batch exported again
+        after a failure or restart overwrites its previous upload instead of duplicating it.
+
+        Args:
+            batch_id (BatchId): The batch id.
+
+        Returns:
+            str: The batch name, 'part-<store id>-<first seq>-<last seq>'.
+        """
+        return f"part-{self.store_id}-{batch_id[0]}-{batch_id[1]}"
+
+    def has_more(self, batch_id: BatchId) -> bool:
+        """
+        Returns whether records were committed after a batch.
+
+        A batch can hold fewer records than its limit while a backlog remains, since its sequence
+        range has gaps where records were updated to a newer sequence number or deduplicated, and
+        `file_size` caps the limit of Parquet exports.
+
+        Args:
+            batch_id (BatchId): The batch id returned by the export.
+
+        Returns:
+            bool: Whether the next export may return records.
+        """
+        return batch_id[1] < self._max_seq
+
+    async def pending_batches(self) -> List[Tuple[BatchId, str]]:
+        """
+        Asynchronously returns the batches of the manifest that are not acknowledged yet.
+
+        Returns:
+            List[Tuple[BatchId, str]]: The batch ids and their delivery state ('exported' or 'uploaded'), in sequence order.
+        """
+        await asyncio.to_thread(self._cursor)
+        return [((first_seq, last_seq), state) for first_seq, (last_seq, state) in sorted(self._batches.items()) if state != "acked"]
+
+    async def mark_uploaded(self, batch_id: BatchId):
+        """
+        Asynchronously records in the manifest that a batch was uploaded, so it is not uploaded again
+        if the exporter restarts before acknowledging it.
+
+        Args:
+            batch_id (BatchId): The batch id returned by the export.
+        """
+        await asyncio.to_thread(lambda: self._set_batch_state(self._cursor(), batch_id, "uploaded"))
+
+    async def ack(self, batch_id: BatchId):
+        """
+        Asynchronously acknowledges an exported batch. Batches must be acknowledged in the order they were exported.
+
+        Args:
+            batch_id (BatchId): The batch id returned by the export.
+        """
+        await asyncio.to_thread(self._ack, batch_id)
+
+    def _ack(self, batch_id: BatchId):
+        """
+        Synchronously acknowledges an exported batch, advancing the acknowledged watermark past its
+        range and dropping the sealed segments that are fully acknowledged.
+
+        Args:
+            batch_id (BatchId): The batch id returned by the export.
+        """
+        _, last_seq = batch_id
+        print(f"Acknowledging database values of batch {batch_id}")
+
+        con = self._cursor()
+
+        with self._segments_lock:
+            self._set_ack_seq(con, last_seq)
+
+            # The manifest keeps the last acknowledged batch
+            self._set_batch_state(con, batch_id, "acked")
+
+            for segment in [segment for segment in self._segments if segment.sealed and segment.last_seq <= self._ack_seq]:
+                self._drop_segment(con, segment)
+
+            self._enforce_backlog(con)
 
-        print("Successfully trimmed database values")
+        print(f"Successfully acknowledged database values of batch {batch_id}")
@@ -1,18 +1,35 @@
 import asyncio
+import functools
+import io
 import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from databricks import sql
+from databricks.sql.client import Connection
+from databricks.sdk import WorkspaceClient
 from databricks.sdk.core import Config, oauth_service_principal
 
+from exporter import TableSink
+
 USER_AGENT = "kelvin.ai"
 
+INGEST_MODES = ["auto", "copy_into", "merge", "insert"]
+
+# Columns identifying a record, matched by the MERGE ingest mode
+MERGE_KEYS = ["timestamp", "asset", "datastream"]
 
-class DatabricksDeltaTableUploader:
+
+class DatabricksDeltaTableUploader(TableSink):
     """
     A class to manage uploading data to a Delta table in Databricks.
 
-    The class supports setting up the Delta table and uploading Pandas DataFrames asynchronously.
+    The class supports setting up the Delta table and uploading Arrow tables asynchronously.
 
     Attributes:
         server_hostname (Optional[str]): The hostname of the Databricks server.
@@ -21,6 +38,12 @@ class DatabricksDeltaTableUploader:
         client_id (Optional[str]): The client ID for OAuth authentication.
         client_secret (Optional[str]): The client secret for OAuth authentication.
         delta_table (Optional[str]): The name of the Delta table in Databricks.
+        rollup_table (Optional[str]): The name of the Delta table receiving rollups in Databricks.
+        staging_volume (Optional[str]): The UC volume in catalog.schema.volume format staging the Parquet files of the bulk ingest modes.
+        ingest_mode (str): How batches are written, one of INGEST_MODES.
+        insert_chunk_size (int): The number of rows per parameterized INSERT statement of the insert mode.
+        idle_timeout (float): The seconds after which an idle SQL connection is closed rather than reused.
+        health_check_interval (float): The seconds a SQL connection can be idle before it is checked prior to reuse.
     """
 
     def __init__(self):
@@ -33,16 +56,99 @@ class DatabricksDeltaTableUploader:
         self.client_id = os.getenv("DATABRICKS_CLIENT_ID")
         self.client_secret = os.getenv("DATABRICKS_CLIENT_SECRET")
         self.delta_table = os.getenv("DATABRICKS_DELTA_TABLE")
+        self.rollup_table = os.getenv("DATABRICKS_DELTA_ROLLUP_TABLE")
+        self.staging_volume = os.getenv("DATABRICKS_STAGING_VOLUME")
+
+        self.ingest_mode = "insert"
+        self.insert_chunk_size = 500
+
+        self.idle_timeout = 600.0
+        self.health_check_interval = 60.0
+
+        # Idle SQL connections with the time they were last used, reused by the next uploads
+        self._connections: List[Tuple[Connection, float]] = []
+        self._connections_lock = threading.Lock()
+        self._credentials = None
+
+        # Connection setup time of the upload running in the current thread
+        self._local = threading.local()
+        self._metrics: Dict[str, Any] = {
+            "connections_opened": 0,
+            "connection_setup_seconds": 0.0,
+            "last_connection_setup_seconds": None,
+            "failed_health_checks": 0,
+            "idle_connections_closed": 0,
+            "uploads": 0,
+            "upload_seconds": 0.0,
+        }
+
+        # Created on first use and shared by the staging uploads
+        self._workspace: Optional[WorkspaceClient] = None
+        self._workspace_lock = threading.Lock()
+
+    async def setup(self) -> None:
+        """
+        Reads the ingest mode.
+
+        'copy_into' stages each batch as a Parquet file in the DATABRICKS_STAGING_VOLUME volume and loads it with COPY INTO,
+        'merge' loads it with MERGE on the timestamp, asset and datastream columns, so batches uploaded again after a
+        failure do not duplicate records. 'insert' runs parameterized INSERT statements of 'delta_insert_chunk_size' rows,
+        and 'auto' uses 'copy_into' when a staging volume is set and 'insert' otherwise.
+
+        Raises:
+            ValueError: If the ingest mode is unknown, or a bulk ingest mode is set without a staging volume.
+        """
+        ingest_mode = self.get_config("delta_ingest_mode", "auto")
+        if ingest_mode not in INGEST_MODES:
+            raise ValueError(f"Unknown delta_ingest_mode '{ingest_mode}', expected one of {INGEST_MODES}")
+
+        if ingest_mode == "auto":
+            ingest_mode = "copy_into" if self.staging_volume else "insert"
+        elif ingest_mode != "insert" and not self.staging_volume:
+            raise ValueError(f"Please set DATABRICKS_STAGING_VOLUME env variable to use the '{ingest_mode}' ingest mode")
+
+        self.ingest_mode = ingest_mode
+        self.insert_chunk_size = max(1, int(self.get_config("delta_insert_chunk_size", self.insert_chunk_size)))
+        self.idle_timeout = float(self.get_config("delta_connection_idle_timeout", self.idle_timeout))
+        self.health_check_interval = float(self.get_config("delta_health_check_interval", self.health_check_interval))
+        print(f"Uploading to Delta tables with the '{self.ingest_mode}' ingest mode")
+
+    async def close(self) -> None:
+        """
+        Closes the pooled SQL connections.
+        """
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+
+        for connection, _ in connections:
+            await asyncio.to_thread(self._close_connection, connection)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the SQL connection metrics: the connections opened and their setup time, the idle connections
+        closed or found broken, and the share of the upload time spent setting up connections.
+
+        Returns:
+            Dict[str, Any]: The metric values by name.
+        """
+        with self._connections_lock:
+            metrics = dict(self._metrics, idle_connections=len(self._connections))
+
+        metrics["connection_setup_share"] = metrics["connection_setup_seconds"] / metrics["upload_seconds"] if metrics["upload_seconds"] else None
+        return metrics
 
     def _credential_provider(self) -> oauth_service_principal:
         """
-        Provides OAuth credentials for authentication.
+        Provides OAuth credentials for authentication, shared by all connections so the OAuth token is only
+        requested again once it expires.
 
         Returns:
             oauth_service_principal: The OAuth service principal for authentication.
         """
-        config = Config(host=f"https://{self.server_hostname}", client_id=self.client_id, client_secret=self.client_secret)
-        return oauth_service_principal(config)
+        if self._credentials is None:
+            config = Config(host=f"https://{self.server_hostname}", client_id=self.client_id, client_secret=self.client_secret)
+            self._credentials = oauth_service_principal(config)
+        return self._credentials
 
     def _connect(self):
         """
@@ -66,36 +172,270 @@ class DatabricksDeltaTableUploader:
 
         raise ValueError("No valid credentials provided for Databricks connection")
 
-    async def upload(self, df: pd.DataFrame) -> None:
+    @contextmanager
+    def _connection(self) -> Iterator[Connection]:
+        """
+        Borrows a SQL connection from the pool, connecting when none is idle, and returns it to the pool after use.
+
+        The most recently used connection is reused first, so the others reach the idle timeout and are closed.
+        A connection idle for longer than the health check interval is checked first, and replaced if broken.
+        A connection that failed is closed rather than returned, so the next upload connects again.
+
+        Yields:
+            sql.Connection: A connection object for executing SQL queries.
+        """
+        now = time.monotonic()
+        with self._connections_lock:
+            expired = [connection for connection, last_used in self._connections if now - last_used > self.idle_timeout]
+            self._connections = [(connection, last_used) for connection, last_used in self._connections if now - last_used <= self.idle_timeout]
+            connection, last_used = self._connections.pop() if self._connections else (None, now)
+            self._metrics["idle_connections_closed"] += len(expired)
+
+        for idle_connection in expired:
+            self._close_connection(idle_connection)
+
+        if connection is not None and now - last_used > self.health_check_interval and not self._is_healthy(connection):
+            print("Reconnecting, the idle Databricks connection failed its health check")
+            self._close_connection(connection)
+            connection = None
+            with self._connections_lock:
+                self._metrics["failed_health_checks"] += 1
+
+        if connection is None:
+            start = time.perf_counter()
+            connection = self._connect()
+            setup_seconds = time.perf_counter() - start
+
+            self._local.setup_seconds = getattr(self._local, "setup_seconds", 0.0) + setup_seconds
+            with self._connections_lock:
+                self._metrics["connections_opened"] += 1
+                self._metrics["connection_setup_seconds"] += setup_seconds
+                self._metrics["last_connection_setup_seconds"] = setup_seconds
+
+        try:
+            yield connection
+        except BaseException:
+            self._close_connection(connection)
+            raise
+
+        with self._connections_lock:
+            self._connections.append((connection, time.monotonic()))
+
+    @staticmethod
+    def _is_healthy(connection: Connection) -> bool:
         """
-        Asynchronously uploads a Pandas DataFrame to the Delta table.
+        Checks that a SQL connection is still open and its session still answers queries.
 
         Args:
-            df (pd.DataFrame): The DataFrame containing the data to upload.
+            connection (sql.Connection): The connection to check.
+
+        Returns:
+            bool: Whether the connection can be reused.
         """
-        await asyncio.to_thread(self._upload, df)
+        try:
+            if not getattr(connection, "open", True):
+                return False
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            return True
+        except Exception as e:
+            print(f"Databricks connection health check failed: {e}")
+            return False
 
-    def _upload(self, df: pd.DataFrame) -> None:
+    @staticmethod
+    def _close_connection(connection: Connection) -> None:
         """
-        Synchronously uploads a Pandas DataFrame to the Delta table.
+        Closes a SQL connection, ignoring the errors of connections that are already broken.
 
         Args:
-            df (pd.DataFrame): The DataFrame containing the data to upload.
+            connection (sql.Connection): The connection to close.
+        """
+        try:
+            connection.close()
+        except Exception as e:
+            print(f"Failed to close Databricks connection: {e}")
+
+    def _workspace_client(self) -> WorkspaceClient:
         """
-        print(f"Uploading DataFrame with {len(df)} records to Delta table: '{self.delta_table}'")
+        Returns the WorkspaceClient staging files in the volume, creating it on first use.
 
-        # Convert Timestamps to strings
-        df["timestamp"] = df["timestamp"].apply(lambda x: x.strftime("%Y-%m-%d %H:%M:%S.%f") if isinstance(x, pd.Timestamp) else x)
+        Returns:
+            WorkspaceClient: An instance of WorkspaceClient configured with either an access token or OAuth credentials.
+
+        Raises:
+            ValueError: If no valid credentials are provided.
+        """
+        with self._workspace_lock:
+            if self._workspace is None:
+                if self.access_token:
+                    self._workspace = WorkspaceClient(host=f"https://{self.server_hostname}", token=self.access_token)
+                elif self.client_id and self.client_secret:
+                    self._workspace = WorkspaceClient(host=f"https://{self.server_hostname}", client_id=self.client_id, client_secret=self.client_secret)
+                else:
+                    raise ValueError("No valid credentials provided for Databricks connection")
+            return self._workspace
 
-        # Generate the SQL INSERT query
-        rows = [f"('{row[0]}', '{row[1]}', '{row[2]}', {row[3]})" for row in df.itertuples(index=False, name=None)]
-        insert_query = f"""
-        INSERT INTO {self.delta_table} (timestamp, asset, datastream, payload)
-        VALUES {', '.join(rows)}
+    async def upload(self, table: pa.Table, rollup: bool = False, name: str = "") -> None:
         """
+        Asynchronously uploads an Arrow table to the Delta table.
+
+        Args:
+            table (pa.Table): The Arrow table containing the data to upload.
+            rollup (bool): Whether the table holds rollups, which are uploaded to the rollup Delta table.
+            name (str): The name of the batch, naming its staged file.
+        """
+        await asyncio.to_thread(self._upload, table, rollup, name)
+
+    def _upload(self, table: pa.Table, rollup: bool = False, name: str = "") -> None:
+        """
+        Synchronously uploads an Arrow table to the Delta table.
+
+        Args:
+            table (pa.Table): The Arrow table containing the data to upload.
+            rollup (bool): Whether the table holds rollups, which are uploaded to the rollup Delta table.
+            name (str): The name of the batch, naming its staged file.
+
+        Raises:
+            ValueError: If uploading rollups without a rollup Delta table.
+        """
+        if rollup and not self.rollup_table:
+            raise ValueError("Please set DATABRICKS_DELTA_ROLLUP_TABLE env variable to upload rollups")
+
+        delta_table = self.rollup_table if rollup else self.delta_table
+        print(f"Uploading table with {table.num_rows} records to Delta table: '{delta_table}' ({self.ingest_mode})")
+
+        start = time.perf_counter()
+        self._local.setup_seconds = 0.0
+
+        # Batches with string or boolean payloads also carry the payload_type, payload_string and payload_boolean columns
+        if self.ingest_mode == "insert":
+            self._insert(table, delta_table)
+        else:
+            # Rollups of an interval spanning two batches are two partial rows with the same keys, so they are appended
+            self._load_staged(table, delta_table, name, merge=self.ingest_mode == "merge" and not rollup)
+
+        upload_seconds = time.perf_counter() - start
+        with self._connections_lock:
+            self._metrics["uploads"] += 1
+            self._metrics["upload_seconds"] += upload_seconds
+
+        print(
+            f"Successfully uploaded {table.num_rows} records to Delta table: '{delta_table}' "
+            f"in {upload_seconds:.2f} s (connection setup {self._local.setup_seconds:.2f} s)"
+        )
+
+    def _insert(self, table: pa.Table, delta_table: str) -> None:
+        """
+        Inserts an Arrow table with parameterized INSERT statements of `insert_chunk_size` rows, so values are
+        never formatted into the SQL text and the statements stay small whatever the batch size.
+
+        Args:
+            table (pa.Table): The records to insert.
+            delta_table (str): The name of the Delta table.
+        """
+        columns = [self._sql_values(column.combine_chunks()) for column in table.columns]
+        rows = list(zip(*columns))
+
+        def insert_query(num_rows: int) -> str:
+            return self._insert_query(delta_table, tuple(table.column_names), num_rows)
+
+        # Full chunks share one statement, the remaining rows are inserted on their own
+        chunks = [[value for row in rows[i : i + self.insert_chunk_size] for value in row] for i in range(0, len(rows), self.insert_chunk_size)]
+        remainder = chunks.pop() if chunks and len(rows) % self.insert_chunk_size else None
+
+        with self._connection() as connection:
+            with connection.cursor() as cursor:
+                if chunks:
+                    cursor.executemany(insert_query(self.insert_chunk_size), chunks)
+                if remainder:
+                    cursor.execute(insert_query(len(remainder) // len(columns)), remainder)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _insert_query(delta_table: str, column_names: Tuple[str, ...], num_rows: int) -> str:
+        """
+        Builds a parameterized INSERT statement, cached so batches with the same columns reuse the statement text.
+
+        Args:
+            delta_table (str): The name of the Delta table.
+            column_names (Tuple[str, ...]): The inserted columns.
+            num_rows (int): The number of rows of the statement.
+
+        Returns:
+            str: The INSERT statement with a `?` parameter marker per value.
+        """
+        row = f"({', '.join('?' * len(column_names))})"
+        return f"INSERT INTO {delta_table} ({', '.join(column_names)}) VALUES {', '.join([row] * num_rows)}"
+
+    @staticmethod
+    def _sql_values(array: pa.Array) -> list:
+        """
+        Converts an Arrow array to the Python values bound to the INSERT parameters.
+
+        Args:
+            array (pa.Array): The values to convert.
+
+        Returns:
+            list: The parameter values. Timestamps are formatted as strings, so they are stored as is in TIMESTAMP_NTZ columns.
+        """
+        if pa.types.is_dictionary(array.type):
+            array = array.cast(array.type.value_type)
+
+        if pa.types.is_timestamp(array.type):
+            array = pc.strftime(array, format="%Y-%m-%d %H:%M:%S")
+
+        return array.to_pylist()
+
+    def _load_staged(self, table: pa.Table, delta_table: str, name: str, merge: bool) -> None:
+        """
+        Stages an Arrow table as a Parquet file in the staging volume and loads it with COPY INTO or MERGE, so the
+        SQL warehouse reads the records in bulk. The staged file is removed once loaded.
+
+        The file is named after the batch, so a batch staged again after a failure or restart keeps its file name,
+        and COPY INTO skips it if it was already loaded.
+
+        Args:
+            table (pa.Table): The records to load.
+            delta_table (str): The name of the Delta table.
+            name (str): The name of the batch.
+            merge (bool): Whether to MERGE the records on MERGE_KEYS rather than appending them with COPY INTO.
+        """
+        catalog_name, schema_name, volume_name = self.staging_volume.split(".")
+        staging_dir = f"/Volumes/{catalog_name}/{schema_name}/{volume_name}/staging"
+        file_name = f"{name}.parquet"
+
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, compression="zstd")
+        buffer.seek(0)
+
+        w = self._workspace_client()
+        w.files.upload(file_path=f"{staging_dir}/{file_name}", contents=buffer, overwrite=True)
+
+        columns = [f"`{name}`" for name in table.column_names]
+        if merge:
+            keys = [f"`{name}`" for name in MERGE_KEYS]
+            query = f"""
+            MERGE INTO {delta_table} AS t
+            USING (SELECT {', '.join(columns)} FROM read_files('{staging_dir}/{file_name}', format => 'parquet')) AS s
+            ON {' AND '.join(f't.{key} = s.{key}' for key in keys)}
+            WHEN MATCHED THEN UPDATE SET {', '.join(f't.{column} = s.{column}' for column in columns if column not in keys)}
+            WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join(f's.{column}' for column in columns)})
+            """
+        else:
+            query = f"""
+            COPY INTO {delta_table}
+            FROM (SELECT {', '.join(columns)} FROM '{staging_dir}')
+            FILEFORMAT = PARQUET
+            FILES = ('{file_name}')
+            """
 
-        with self._connect() as connection:
+        with self._connection() as connection:
             with connection.cursor() as cursor:
-                cursor.execute(insert_query)
+                cursor.execute(query)
 
-        print(f"Successfully uploaded {len(df)} records to Delta table: '{self.delta_table}'")
+        # A file left after a failed load is overwritten when the batch is staged again
+        try:
+            w.files.delete(f"{staging_dir}/{file_name}")
+        except Exception as e:
+            print(f"Failed to remove staged file '{staging_dir}/{file_name}': {e}")
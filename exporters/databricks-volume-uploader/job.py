@@ -82,7 +82,7 @@ def create_job_autoloader(w: WorkspaceClient, volume: str, table: str, cluster_i
     # Generate code
     checkpoint_path = f"/Volumes/{catalog_name}/{schema_name}/{volume_name}/checkpoints/"
 
-    code = f"""from pyspark.sql.types import StructType, StructField, StringType, TimestampNTZType, DoubleType
+    code = f"""from pyspark.sql.types import StructType, StructField, StringType, TimestampNTZType, DoubleType, BooleanType
 
 # Define Schema
 schema = StructType(
@@ -91,6 +91,9 @@ schema = StructType(
     StructField("asset", StringType(), True),
     StructField("datastream", StringType(), True),
     StructField("payload", DoubleType(), True),
+    StructField("payload_type", StringType(), True),
+    StructField("payload_string", StringType(), True),
+    StructField("payload_boolean", BooleanType(), True),
   ]
 )
 
@@ -1,10 +1,13 @@
 import asyncio
 import os
-from pathlib import Path
+import threading
+from typing import IO, Optional
 
 from databricks.sdk import WorkspaceClient, useragent
+from databricks.sdk.core import Config
 
 import job
+from exporter import FileSink
 
 # Set user agent
 PRODUCT = "kelvin-databricks-volume-uploader"
@@ -14,7 +17,7 @@ useragent.with_partner("kelvin.ai")
 useragent.with_product(PRODUCT, version=PRODUCT_VERSION)
 
 
-class DatabricksUCVolumeUploader:
+class DatabricksUCVolumeUploader(FileSink):
     """
     A utility class for uploading files to Databricks Unity Catalog Volume.
 
@@ -23,6 +26,9 @@ class DatabricksUCVolumeUploader:
     of data ingestion jobs using SQL or Python based on the provided warehouse or cluster ID.
     """
 
+    # The ingestion jobs load the data/ directory of the volume
+    data_dir = "data"
+
     def __init__(self):
         """
         Initialize the DatabricksUCVolumeUploader instance by reading environment variables.
@@ -36,6 +42,8 @@ class DatabricksUCVolumeUploader:
             delta_table (str): The Delta table in catalog.schema.table format, retrieved from DATABRICKS_DELTA_TABLE.
             job_cluster_id (str): Cluster ID for job setup, retrieved from DATABRICKS_JOB_CLUSTER_ID.
             job_warehouse_id (str): Warehouse ID for job setup, retrieved from DATABRICKS_JOB_WAREHOUSE_ID.
+            part_size (Optional[int]): Part size in bytes of multipart uploads, None to let the SDK choose it.
+            parallelism (int): Parts uploaded at once per file.
         """
         self.server_hostname = os.getenv("DATABRICKS_SERVER_HOSTNAME")
         self.access_token = os.getenv("DATABRICKS_ACCESS_TOKEN")
@@ -46,33 +54,61 @@ class DatabricksUCVolumeUploader:
         self.job_cluster_id = os.getenv("DATABRICKS_JOB_CLUSTER_ID")
         self.job_warehouse_id = os.getenv("DATABRICKS_JOB_WAREHOUSE_ID")
 
-    def _workspace_client(self):
+        self.part_size: Optional[int] = None
+        self.parallelism = 4
+        self.max_connections = 10
+
+        # Created on first use and shared by every upload
+        self._client: Optional[WorkspaceClient] = None
+        self._client_lock = threading.Lock()
+
+    def _workspace_client(self) -> WorkspaceClient:
         """
-        Create and return a Databricks WorkspaceClient instance.
+        Return the Databricks WorkspaceClient shared by the job setup and all uploads, creating it on first use.
+
+        The client keeps its HTTP connection pool and its credentials, so OAuth tokens are only exchanged
+        once and then refreshed by the SDK in the background before they expire.
 
         Returns:
             WorkspaceClient: An instance of WorkspaceClient configured with either an access token or OAuth credentials.
 
+        Raises:
+            ValueError: If neither access token nor OAuth credentials are provided.
+        """
+        with self._client_lock:
+            if self._client is None:
+                self._client = WorkspaceClient(config=self._client_config())
+            return self._client
+
+    def _client_config(self) -> Config:
+        """
+        Create the configuration of the WorkspaceClient, with a connection pool sized for the parts in flight.
+
+        Returns:
+            Config: The client configuration with either an access token or OAuth credentials.
+
         Raises:
             ValueError: If neither access token nor OAuth credentials are provided.
         """
         if self.access_token:
             print("Creating WorkspaceClient using access token...")
-            return WorkspaceClient(
+            return Config(
                 host=self.server_hostname,
                 token=self.access_token,
                 product=PRODUCT,
                 product_version=PRODUCT_VERSION,
+                max_connections_per_pool=self.max_connections,
             )
 
         if self.client_id and self.client_secret:
             print("Creating WorkspaceClient using OAuth credentials...")
-            return WorkspaceClient(
+            return Config(
                 host=self.server_hostname,
                 client_id=self.client_id,
                 client_secret=self.client_secret,
                 product=PRODUCT,
                 product_version=PRODUCT_VERSION,
+                max_connections_per_pool=self.max_connections,
             )
 
         raise ValueError("No valid credentials provided for Databricks")
@@ -80,7 +116,17 @@ class DatabricksUCVolumeUploader:
     async def setup(self) -> None:
         """
         Asynchronous wrapper for the `_setup` method to facilitate job setup in the Databricks environment.
+
+        Files of more than 'volume_part_size' bytes are uploaded in parts, with up to 'volume_upload_parallelism'
+        parts in flight per file. The connection pool of the client is sized for these parts across the files
+        uploaded at once.
         """
+        part_size = self.get_config("volume_part_size")
+        self.part_size = int(part_size) if part_size else None
+        self.parallelism = max(1, int(self.get_config("volume_upload_parallelism", self.parallelism)))
+        files_in_flight = max(1, int(self.get_config("upload_concurrency", 1))) * max(1, int(self.get_config("upload_file_concurrency", 1)))
+        self.max_connections = max(self.max_connections, self.parallelism * files_in_flight)
+
         await asyncio.to_thread(self._setup)
 
     def _setup(self) -> None:
@@ -109,21 +155,33 @@ class DatabricksUCVolumeUploader:
         else:
             print("Skipping job creation because env vars DATABRICKS_WAREHOUSE_ID and DATABRICKS_CLUSTER_ID were not provided")
 
-    async def upload(self, file_path: str) -> None:
+        # Authenticate once at startup, instead of on the first upload
+        self._workspace_client().config.authenticate()
+
+    async def close(self) -> None:
+        """
+        Release the shared WorkspaceClient.
+        """
+        with self._client_lock:
+            self._client = None
+
+    async def upload(self, file_path: str, dest_dir: str = "data") -> None:
         """
         Asynchronous wrapper for the `_upload` method to facilitate file upload to the Databricks volume.
 
         Args:
             file_path (str): The local file path of the file to be uploaded.
+            dest_dir (str): The directory of the file in the volume. Defaults to 'data'.
         """
-        await asyncio.to_thread(self._upload, file_path)
+        await asyncio.to_thread(self._upload, file_path, dest_dir)
 
-    def _upload(self, file_path: str) -> None:
+    def _upload(self, file_path: str, dest_dir: str = "data") -> None:
         """
         Upload a local file to the specified Databricks UC volume path.
 
         Args:
             file_path (str): The local file path of the file to be uploaded.
+            dest_dir (str): The directory of the file in the volume. Defaults to 'data'.
 
         Behavior:
             The file is uploaded to the specified UC volume path, which is constructed based on the UC volume and file name.
@@ -131,14 +189,65 @@ class DatabricksUCVolumeUploader:
         Raises:
             ValueError: If the upload fails or if no credentials are available.
         """
-        # Create volume path
-        catalog_name, schema_name, volume_name = self.uc_volume.split(".")
-        volume_path = f"/Volumes/{catalog_name}/{schema_name}/{volume_name}/data/{Path(file_path).name}"
+        volume_path = self._volume_path(os.path.basename(file_path), dest_dir)
+
+        print(f"Uploading file '{file_path}' to Databricks path: '{volume_path}'")
+
+        w = self._workspace_client()
+        w.files.upload_from(file_path=volume_path, source_path=file_path, overwrite=True, **self._transfer_options())
+
+        print(f"Successfully uploaded file to Databricks path: '{volume_path}'")
+
+    async def upload_stream(self, data: IO[bytes], file_name: str, dest_dir: str = "data") -> None:
+        """
+        Asynchronous wrapper for the `_upload_stream` method to facilitate in-memory uploads to the Databricks volume.
+
+        Args:
+            data (IO[bytes]): The file object to be uploaded.
+            file_name (str): The name of the file in the volume.
+            dest_dir (str): The directory of the file in the volume. Defaults to 'data'.
+        """
+        await asyncio.to_thread(self._upload_stream, data, file_name, dest_dir)
+
+    def _upload_stream(self, data: IO[bytes], file_name: str, dest_dir: str = "data") -> None:
+        """
+        Upload the contents of a file object to the specified Databricks UC volume path.
+
+        Args:
+            data (IO[bytes]): The file object to be uploaded.
+            file_name (str): The name of the file in the volume.
+            dest_dir (str): The directory of the file in the volume. Defaults to 'data'.
+
+        Raises:
+            ValueError: If the upload fails or if no credentials are available.
+        """
+        volume_path = self._volume_path(file_name, dest_dir)
 
         print(f"Uploading file to Databricks path: '{volume_path}'")
 
-        with open(file_path, "rb") as f:
-            w = self._workspace_client()
-            w.dbfs.upload(path=volume_path, src=f, overwrite=True)
+        w = self._workspace_client()
+        w.files.upload(file_path=volume_path, contents=data, overwrite=True, **self._transfer_options())
 
         print(f"Successfully uploaded file to Databricks path: '{volume_path}'")
+
+    def _volume_path(self, file_name: str, dest_dir: str) -> str:
+        """
+        Build the path of a file in the UC volume.
+
+        Args:
+            file_name (str): The name of the file in the volume.
+            dest_dir (str): The directory of the file in the volume.
+
+        Returns:
+            str: The absolute volume path, e.g. /Volumes/catalog/schema/volume/data/file.parquet.
+        """
+        catalog_name, schema_name, volume_name = self.uc_volume.split(".")
+        return f"/Volumes/{catalog_name}/{schema_name}/{volume_name}/{dest_dir}/{file_name}"
+
+    def _transfer_options(self) -> dict:
+        """
+        Return the multipart options of the Files API uploads. Parts are only uploaded in parallel above one part in flight.
+        """
+        if self.parallelism > 1:
+            return {"part_size": self.part_size, "use_parallel": True, "parallelism": self.parallelism}
+        return {"part_size": self.part_size, "use_parallel": False}